@@ -0,0 +1,42 @@
+"""Process-local TTL cache for read-mostly API payloads."""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+# key -> (expires_at, value), expires_at on the monotonic clock
+_entries: Dict[str, Tuple[float, Any]] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_or_compute(key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Return the cached value for key, computing it with loader when missing or expired.
+
+    Concurrent misses for the same key wait for a single loader call.
+
+    Args:
+        key: Cache key
+        ttl: Lifetime of a computed value in seconds
+        loader: Coroutine function producing the value
+
+    Returns:
+        Cached or freshly computed value
+    """
+    entry = _entries.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        value = await loader()
+        _entries[key] = (time.monotonic() + ttl, value)
+        return value
+
+
+def invalidate(*keys: str):
+    """Drop cached values so the next read recomputes them."""
+    for key in keys:
+        _entries.pop(key, None)
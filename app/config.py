@@ -1,69 +1,119 @@
 """Configuration management from environment variables."""
 import os
+from dataclasses import dataclass, field, fields
+from functools import cached_property
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import Mapping, Optional
+from dotenv import dotenv_values
 
-# Load .env file
 env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
 
+# Set once the .env file has been merged into os.environ; child processes,
+# reloads and re-imports inherit it and skip re-parsing the file.
+# Deployments that inject the environment (docker, systemd) can set
+# ENV_LOADED=1 to skip the file entirely.
+_DOTENV_SENTINEL = '_DOTENV_LOADED'
 
+
+def _load_env() -> dict:
+    """Merge .env into os.environ at most once; real env vars take precedence."""
+    if (
+        not os.environ.get(_DOTENV_SENTINEL)
+        and os.environ.get('ENV_LOADED') != '1'
+        and env_path.exists()
+    ):
+        for key, value in dotenv_values(dotenv_path=env_path).items():
+            if value is not None:
+                os.environ.setdefault(key, value)
+        os.environ[_DOTENV_SENTINEL] = '1'
+    return dict(os.environ)
+
+
+_raw = _load_env()
+
+
+@dataclass(frozen=True)
 class Config:
-    """Application configuration."""
-    
+    """Application configuration (immutable snapshot built once at import)."""
+
     # NSX-T Manager
-    NSX_MANAGER_URL: str = os.getenv('NSX_MANAGER_URL', 'https://nsx01cast.t-cloud.kz')
-    NSX_USERNAME: str = os.getenv('NSX_USERNAME', '')
-    NSX_PASSWORD: str = os.getenv('NSX_PASSWORD', '')
-    
+    NSX_MANAGER_URL: str = 'https://nsx01cast.t-cloud.kz'
+    NSX_USERNAME: str = ''
+    NSX_PASSWORD: str = ''
+
     # ETN SSH
-    ETN_SSH_USERNAME: str = os.getenv('ETN_SSH_USERNAME', '')
-    ETN_SSH_PASSWORD: str = os.getenv('ETN_SSH_PASSWORD', '')
-    ETN_SSH_PORT: int = int(os.getenv('ETN_SSH_PORT', '22'))
-    ETN_SSH_TIMEOUT: int = 30  # seconds
-    
+    ETN_SSH_USERNAME: str = ''
+    ETN_SSH_PASSWORD: str = ''
+    ETN_SSH_PORT: int = 22
+    ETN_SSH_TIMEOUT: int = field(default=30, init=False)  # seconds
+    ETN_SSH_MAX_CONCURRENCY: int = 20  # SSH sessions open at the same time
+
     # Telegram
-    TELEGRAM_BOT_TOKEN: str = os.getenv('TELEGRAM_BOT_TOKEN', '')
-    TELEGRAM_CHAT_ID: str = os.getenv('TELEGRAM_CHAT_ID', '')
-    
+    TELEGRAM_BOT_TOKEN: str = ''
+    TELEGRAM_CHAT_ID: str = ''
+
     # Scheduler (cron expressions)
-    NSX_CHECK_CRON: str = os.getenv('NSX_CHECK_CRON', '0 2 */2 * *')  # Every 2 days at 02:00
-    CERT_CHECK_CRON: str = os.getenv('CERT_CHECK_CRON', '0 3 * * 1')  # Every Monday at 03:00
-    
+    NSX_CHECK_CRON: str = '0 2 */2 * *'  # Every 2 days at 02:00
+    CERT_CHECK_CRON: str = '0 3 * * 1'  # Every Monday at 03:00
+
     # Certificate warnings
-    CERT_WARNING_DAYS: int = int(os.getenv('CERT_WARNING_DAYS', '30'))
-    
+    CERT_WARNING_DAYS: int = 30
+    # Nodes in NSX maintenance mode usually refuse SSH; skip them unless enabled
+    CERT_CHECK_MAINTENANCE_NODES: bool = False
+
     # Database
-    DATABASE_URL: str = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///./etn_monitor.db')
-    
+    DATABASE_URL: str = 'sqlite+aiosqlite:///./etn_monitor.db'
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+
     # Web Server
-    WEB_HOST: str = os.getenv('WEB_HOST', '0.0.0.0')
-    WEB_PORT: int = int(os.getenv('WEB_PORT', '8000'))
-    
+    WEB_HOST: str = '0.0.0.0'
+    WEB_PORT: int = 8000
+    WEB_ORIGIN: str = 'https://web-etn-mon.t-cloud.kz'  # Comma-separated CORS origins
+
     # ETN Filtering (optional - for testing specific nodes)
-    ETN_WHITELIST: str = os.getenv('ETN_WHITELIST', '')  # Comma-separated IPs
-    
-    @classmethod
-    def get_etn_whitelist(cls) -> list:
-        """Get list of whitelisted ETN IPs."""
-        if not cls.ETN_WHITELIST:
-            return []
-        return [ip.strip() for ip in cls.ETN_WHITELIST.split(',') if ip.strip()]
-    
+    ETN_WHITELIST: str = ''  # Comma-separated IPs
+
     @classmethod
-    def validate(cls):
+    def from_env(cls, env: Optional[Mapping[str, Optional[str]]] = None) -> 'Config':
+        """Build config from environment in one pass, converting types once."""
+        env = _raw if env is None else env
+        values = {}
+        for f in fields(cls):
+            if not f.init:
+                continue
+            value = env.get(f.name)
+            if value is None:
+                continue
+            if f.type is bool:
+                values[f.name] = value.strip().lower() in ('1', 'true', 'yes', 'on')
+            else:
+                values[f.name] = f.type(value)
+        return cls(**values)
+
+    @cached_property
+    def etn_whitelist(self) -> frozenset:
+        """Set of whitelisted ETN IPs (parsed once per process)."""
+        return frozenset(ip.strip() for ip in self.ETN_WHITELIST.split(',') if ip.strip())
+
+    @cached_property
+    def web_origins(self) -> list:
+        """List of origins allowed by CORS."""
+        return [origin.strip() for origin in self.WEB_ORIGIN.split(',') if origin.strip()]
+
+    def validate(self):
         """Validate required configuration."""
         required = [
-            ('NSX_USERNAME', cls.NSX_USERNAME),
-            ('NSX_PASSWORD', cls.NSX_PASSWORD),
-            ('ETN_SSH_USERNAME', cls.ETN_SSH_USERNAME),
-            ('ETN_SSH_PASSWORD', cls.ETN_SSH_PASSWORD),
+            ('NSX_USERNAME', self.NSX_USERNAME),
+            ('NSX_PASSWORD', self.NSX_PASSWORD),
+            ('ETN_SSH_USERNAME', self.ETN_SSH_USERNAME),
+            ('ETN_SSH_PASSWORD', self.ETN_SSH_PASSWORD),
         ]
-        
+
         missing = [name for name, value in required if not value]
         if missing:
             raise ValueError(f"Missing required configuration: {', '.join(missing)}")
 
 
 # Global config instance
-config = Config()
+config = Config.from_env()
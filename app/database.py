@@ -1,15 +1,62 @@
 """Database connection and session management."""
+from sqlalchemy import event, inspect, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from app.config import config
-from app.models import Base
+from app.models import Base, CertificateCheck, TransportNode
 
-# Create async engine
+IS_SQLITE = config.DATABASE_URL.startswith('sqlite')
+
+IS_SQLITE_MEMORY = IS_SQLITE and ':memory:' in config.DATABASE_URL
+
+if IS_SQLITE_MEMORY:
+    # Every connection to :memory: is a separate database, so share one
+    pool_kwargs = {'poolclass': StaticPool}
+else:
+    # aiosqlite file URLs default to NullPool, which rejects sizing arguments;
+    # a queue pool keeps WAL readers' connections open between requests
+    pool_kwargs = {
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': 30,  # seconds to wait for a free connection
+        'pool_recycle': 1800,  # seconds
+    }
+    if IS_SQLITE:
+        pool_kwargs['poolclass'] = AsyncAdaptedQueuePool
+
+# Create async engine with an explicitly sized connection pool
 engine = create_async_engine(
     config.DATABASE_URL,
     echo=False,  # Set to True for SQL query logging
-    future=True
+    future=True,
+    pool_pre_ping=True,
+    query_cache_size=1200,  # compiled statements kept per engine
+    connect_args={'check_same_thread': False} if IS_SQLITE else {},
+    **pool_kwargs
 )
 
+# Per-connection SQLite tuning. WAL lets dashboard readers run concurrently
+# with scheduler writes; it assumes a single writer process (one app instance),
+# otherwise writers contend on WAL checkpoints.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',  # fsync at checkpoints only, safe with WAL
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64 MiB page cache
+    'PRAGMA mmap_size=268435456',  # 256 MiB
+    'PRAGMA foreign_keys=ON',
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Apply SQLITE_PRAGMAS to every new pool connection."""
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
 # Create session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -24,12 +71,65 @@ async def init_db():
     """Initialize database tables."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all skips existing tables, so add columns and indexes introduced later
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        # Checks stored before expiry_bucket existed
+        await conn.execute(
+            update(CertificateCheck)
+            .where(CertificateCheck.check_status == 'success', CertificateCheck.expiry_bucket.is_(None))
+            .values(expiry_bucket=CertificateCheck.expiry_bucket_expr())
+        )
+        # Nodes checked before latest_cert_expiry existed
+        await conn.execute(
+            update(TransportNode)
+            .where(TransportNode.latest_cert_expiry.is_(None))
+            .values(latest_cert_expiry=(
+                select(CertificateCheck.cert_expiry_date)
+                .where(
+                    CertificateCheck.node_id == TransportNode.id,
+                    CertificateCheck.check_status == 'success'
+                )
+                .order_by(CertificateCheck.checked_at.desc())
+                .limit(1)
+                .scalar_subquery()
+            ), updated_at=TransportNode.updated_at)  # backfill, not a node change
+        )
+        # Refresh planner statistics so the indexes are picked up
+        await conn.execute(text('ANALYZE'))
+
+
+def _add_missing_columns(sync_conn):
+    """Add nullable columns declared on models that are missing in the database."""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                ))
+
+
+def _create_missing_indexes(sync_conn):
+    """Create indexes declared on models that are missing in the database."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+def dialect_insert(model):
+    """INSERT construct of the configured backend, supporting ON CONFLICT clauses."""
+    return (sqlite.insert if IS_SQLITE else postgresql.insert)(model)
+
+
+def insert_ignoring_duplicates(model):
+    """INSERT that skips rows violating a unique constraint (ON CONFLICT DO NOTHING)."""
+    return dialect_insert(model).on_conflict_do_nothing()
 
 
 async def get_db():
-    """Dependency for getting database session."""
+    """Dependency for getting database session (closed by the context manager)."""
     async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+        yield session
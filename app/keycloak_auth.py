@@ -1,15 +1,17 @@
 # app/keycloak_auth.py
 import os
-from typing import Optional
-from fastapi import Depends, HTTPException, status, Cookie
+import threading
+import time
+from typing import Dict, Optional
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from keycloak import KeycloakOpenID
-from jose import JWTError, jwt
-from dotenv import load_dotenv
+from jose import ExpiredSignatureError, JWTError, jwt
 import logging
 import urllib3
 
-load_dotenv()
+import app.config  # noqa: F401  (merges .env into os.environ once)
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +54,20 @@ if KEYCLOAK_ENABLED:
 
 security = HTTPBearer()
 
+# Проверенные токены кэшируются до истечения их собственного exp
+TOKEN_CACHE_MAX_SIZE = 1024
+_token_cache: Dict[str, dict] = {}
+# verify_token выполняется в пуле потоков; вытеснение и запись - под блокировкой
+_token_cache_lock = threading.Lock()
+
+# Публичный ключ realm в PEM, заполняется при первой проверке токена
+_public_key_pem: Optional[str] = None
+_public_key_fetched_at = 0.0
+
+# После невалидного токена ключ перечитывается не чаще, чем раз в интервал (сек),
+# чтобы чужие или битые cookie не вызывали запрос к Keycloak на каждый запрос
+PUBLIC_KEY_MIN_REFRESH_INTERVAL = 60
+
 
 class KeycloakUser:
     """Модель пользователя из Keycloak"""
@@ -63,6 +79,34 @@ class KeycloakUser:
         self.is_active = True
 
 
+def get_public_key() -> str:
+    """Публичный ключ realm (запрашивается у Keycloak один раз)"""
+    global _public_key_pem, _public_key_fetched_at
+    if _public_key_pem is None:
+        _public_key_pem = (
+            "-----BEGIN PUBLIC KEY-----\n"
+            + keycloak_openid.public_key()
+            + "\n-----END PUBLIC KEY-----"
+        )
+        _public_key_fetched_at = time.monotonic()
+    return _public_key_pem
+
+
+def _reset_public_key():
+    """Сброс кэшированного публичного ключа (не чаще PUBLIC_KEY_MIN_REFRESH_INTERVAL)"""
+    global _public_key_pem
+    if time.monotonic() - _public_key_fetched_at >= PUBLIC_KEY_MIN_REFRESH_INTERVAL:
+        _public_key_pem = None
+
+
+def _cached_token_info(token: str) -> Optional[dict]:
+    """Claims ранее проверенного токена, если он ещё не истёк"""
+    cached = _token_cache.get(token)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
+    return None
+
+
 def verify_token(token: str) -> dict:
     """Проверка токена через Keycloak"""
     if not keycloak_openid:
@@ -71,14 +115,11 @@ def verify_token(token: str) -> dict:
             detail="Keycloak service is not available"
         )
     
+    cached = _cached_token_info(token)
+    if cached is not None:
+        return cached
+    
     try:
-        # Получаем публичный ключ от Keycloak
-        KEYCLOAK_PUBLIC_KEY = (
-            "-----BEGIN PUBLIC KEY-----\n"
-            + keycloak_openid.public_key()
-            + "\n-----END PUBLIC KEY-----"
-        )
-        
         # Настройки для валидации токена
         options = {
             "verify_signature": True,
@@ -89,14 +130,22 @@ def verify_token(token: str) -> dict:
         # Декодируем и валидируем токен
         token_info = jwt.decode(
             token,
-            KEYCLOAK_PUBLIC_KEY,
+            get_public_key(),
             algorithms=["RS256"],
             options=options
         )
         
+        with _token_cache_lock:
+            if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+                _token_cache.pop(next(iter(_token_cache), None), None)
+            _token_cache[token] = token_info
+        
         return token_info
         
     except JWTError as e:
+        if not isinstance(e, ExpiredSignatureError):
+            # Ключ мог смениться в Keycloak - перечитаем его при следующей проверке
+            _reset_public_key()
         logger.error(f"Token validation error: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -112,66 +161,76 @@ def verify_token(token: str) -> dict:
         )
 
 
+async def verify_token_async(token: str) -> dict:
+    """
+    verify_token без блокировки event loop: кэшированные токены отдаются сразу,
+    остальные проверяются в пуле потоков (возможен запрос ключа к Keycloak).
+    """
+    cached = _cached_token_info(token)
+    if cached is not None:
+        return cached
+    return await run_in_threadpool(verify_token, token)
+
+
 # ============ COOKIE-BASED AUTHENTICATION (для веб-интерфейса) ============
 
-async def get_current_user_from_cookie(
-    access_token: Optional[str] = Cookie(None)
-) -> KeycloakUser:
+def _user_from_token_info(token_info: dict) -> KeycloakUser:
+    """Создание KeycloakUser из claims проверенного токена"""
+    # Извлекаем роли из токена
+    roles = []
+    if "realm_access" in token_info:
+        roles = token_info["realm_access"].get("roles", [])
+    
+    return KeycloakUser(
+        username=token_info.get("preferred_username", "unknown"),
+        email=token_info.get("email", ""),
+        roles=roles,
+        user_id=token_info.get("sub", "")
+    )
+
+
+async def resolve_cookie_user(access_token: Optional[str]) -> Optional[KeycloakUser]:
     """
-    Получение текущего пользователя из HTTP-only cookie.
-    Используется для защиты веб-страниц.
+    Пользователь из access_token cookie или None, если токена нет или он невалиден.
     """
     if not access_token:
-        logger.warning("No access_token cookie found, redirecting to login")
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            detail="Not authenticated",
-            headers={"Location": "/login"}
-        )
+        return None
     
     try:
-        # Верифицируем токен
-        token_info = verify_token(access_token)
-        
-        # Извлекаем данные пользователя
-        username = token_info.get("preferred_username", "unknown")
-        email = token_info.get("email", "")
-        user_id = token_info.get("sub", "")
-        
-        # Извлекаем роли из токена
-        roles = []
-        if "realm_access" in token_info:
-            roles = token_info["realm_access"].get("roles", [])
-        
-        # Создаем объект пользователя
-        user = KeycloakUser(
-            username=username,
-            email=email,
-            roles=roles,
-            user_id=user_id
-        )
-        
-        logger.debug(f"User authenticated from cookie: {username}")
+        user = _user_from_token_info(await verify_token_async(access_token))
+        logger.debug(f"User authenticated from cookie: {user.username}")
         return user
-        
     except HTTPException as e:
-        # Если это уже редирект, пробросим его
-        if e.status_code == status.HTTP_307_TEMPORARY_REDIRECT:
-            raise
-        # Иначе токен невалиден - редиректим на логин
-        logger.warning(f"Invalid token in cookie, redirecting to login: {e.detail}")
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            detail="Invalid token",
-            headers={"Location": "/login"}
-        )
+        logger.warning(f"Invalid token in cookie: {e.detail}")
     except Exception as e:
         logger.error(f"Error getting current user from cookie: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            detail="Authentication error",
-            headers={"Location": "/login"}
-        )
+    return None
+
+
+async def get_current_user_from_cookie(request: Request) -> KeycloakUser:
+    """
+    Получение текущего пользователя из HTTP-only cookie.
+    Cookie проверяется только на защищённых страницах, один раз на запрос
+    (результат сохраняется в request.state.user).
+    Используется для защиты веб-страниц.
+    """
+    if not hasattr(request.state, "user"):
+        request.state.user = await resolve_cookie_user(request.cookies.get("access_token"))
+    user = request.state.user
+    if user is not None:
+        return user
+    
+    if not request.cookies.get("access_token"):
+        logger.warning("No access_token cookie found, redirecting to login")
+        detail = "Not authenticated"
+    else:
+        logger.warning("Invalid token in cookie, redirecting to login")
+        detail = "Invalid token"
+    raise HTTPException(
+        status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+        detail=detail,
+        headers={"Location": "/login"}
+    )
 
 
 # ============ BEARER TOKEN AUTHENTICATION (для API) ============
@@ -187,27 +246,9 @@ async def get_current_user(
     
     try:
         # Верифицируем токен
-        token_info = verify_token(token)
-        
-        # Извлекаем данные пользователя
-        username = token_info.get("preferred_username", "unknown")
-        email = token_info.get("email", "")
-        user_id = token_info.get("sub", "")
-        
-        # Извлекаем роли из токена
-        roles = []
-        if "realm_access" in token_info:
-            roles = token_info["realm_access"].get("roles", [])
-        
-        # Создаем объект пользователя
-        user = KeycloakUser(
-            username=username,
-            email=email,
-            roles=roles,
-            user_id=user_id
-        )
+        user = _user_from_token_info(await verify_token_async(token))
         
-        logger.info(f"User authenticated: {username} (roles: {roles})")
+        logger.info(f"User authenticated: {user.username} (roles: {user.roles})")
         return user
         
     except HTTPException:
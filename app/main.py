@@ -1,22 +1,26 @@
 """FastAPI application for ETN certificate monitoring with Keycloak auth."""
-import asyncio
+import hashlib
 import logging
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Type
 from pathlib import Path
+from urllib.parse import urlencode
 
 from fastapi import FastAPI, Depends, Request, HTTPException, status, Query, Response
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from pydantic import BaseModel
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
+from app import cache
 from app.config import config
-from app.database import get_db, init_db
+from app.database import engine, get_db, init_db
 from app.models import TransportNode, CertificateCheck, NodeEvent
 from app.schemas import (
     TransportNodeSchema, NodeDetailSchema, NodeEventSchema,
@@ -44,6 +48,10 @@ logger = logging.getLogger(__name__)
 # Global scheduler instance
 scheduler_service: Optional[SchedulerService] = None
 
+# Login page is static, so it is read once at startup
+LOGIN_HTML_PATH = Path(__file__).parent.parent / "templates" / "login.html"
+login_html: Optional[bytes] = None
+
 
 # ============ PYDANTIC MODELS ============
 
@@ -68,7 +76,7 @@ class RefreshTokenRequest(BaseModel):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application startup and shutdown."""
-    global scheduler_service
+    global scheduler_service, login_html
     
     # Startup
     logger.info("Starting ETN Certificate Monitor...")
@@ -85,6 +93,12 @@ async def lifespan(app: FastAPI):
         logger.error(f"Configuration error: {e}")
         raise
     
+    # Load static login page
+    try:
+        login_html = LOGIN_HTML_PATH.read_bytes()
+    except OSError as e:
+        logger.warning(f"Login page not loaded: {e}")
+    
     # Initialize database
     await init_db()
     logger.info("Database initialized")
@@ -103,7 +117,7 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down...")
     if scheduler_service:
-        scheduler_service.shutdown()
+        await scheduler_service.shutdown()
     logger.info("Application stopped")
 
 
@@ -112,33 +126,56 @@ app = FastAPI(
     title="ETN Certificate Monitor",
     description="Monitor Edge Transport Node SSL certificates from NSX-T Manager",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=config.web_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["authorization", "content-type"],
+    expose_headers=["X-Next-Cursor"],
+    max_age=86400,  # browsers may skip preflights for a day
 )
 
-# Setup templates
-templates = Jinja2Templates(directory="templates")
+# Setup templates (compiled bytecode cached on disk, no per-render mtime checks)
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"),
+        bytecode_cache=FileSystemBytecodeCache(),
+        auto_reload=False,
+        autoescape=True
+    )
+)
+
+# Cache lifetimes (seconds); the scheduler also invalidates after writes
+DASHBOARD_CACHE_TTL = 30
+HEALTH_CACHE_TTL = 3
+
+# Rendered dashboard HTML keyed by ETag (oldest entry evicted first)
+DASHBOARD_HTML_CACHE_SIZE = 4
+_dashboard_html_cache: Dict[str, str] = {}
+
+
+# ============ AUTH DEPENDENCIES ============
+
+async def no_auth() -> None:
+    """Stand-in auth dependency when Keycloak is disabled"""
+    return None
+
+
+# Built once at import and shared by every protected endpoint
+AUTH_DEP = Depends(get_current_active_user) if KEYCLOAK_ENABLED else Depends(no_auth)
+COOKIE_AUTH_DEP = Depends(get_current_user_from_cookie) if KEYCLOAK_ENABLED else Depends(no_auth)
 
 
 # ============ AUTHENTICATION ENDPOINTS ============
 
-@app.post("/api/login", response_model=Token)
 async def login(user_login: UserLogin):
     """Вход в систему через Keycloak"""
-    if not KEYCLOAK_ENABLED:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Keycloak authentication is not enabled"
-        )
-    
     try:
         token_data = login_user(user_login.username, user_login.password)
         return token_data
@@ -152,15 +189,8 @@ async def login(user_login: UserLogin):
         )
 
 
-@app.post("/api/refresh", response_model=Token)
 async def refresh(refresh_request: RefreshTokenRequest):
     """Обновление токена"""
-    if not KEYCLOAK_ENABLED:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Keycloak authentication is not enabled"
-        )
-    
     try:
         token_data = refresh_keycloak_token(refresh_request.refresh_token)
         return token_data
@@ -174,16 +204,12 @@ async def refresh(refresh_request: RefreshTokenRequest):
         )
 
 
-@app.post("/api/logout")
 async def logout(
     response: Response,
     refresh_request: RefreshTokenRequest = None,
-    current_user: KeycloakUser = Depends(get_current_active_user) if KEYCLOAK_ENABLED else None
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Выход из системы"""
-    if not KEYCLOAK_ENABLED:
-        return {"message": "Keycloak authentication is not enabled"}
-    
     try:
         if refresh_request:
             logout_user(refresh_request.refresh_token)
@@ -198,18 +224,8 @@ async def logout(
         return {"message": "Logged out (with warnings)"}
 
 
-@app.get("/api/verify")
-async def verify_token(current_user: KeycloakUser = Depends(get_current_user_from_cookie) if KEYCLOAK_ENABLED else None):
+async def verify_token(current_user: Optional[KeycloakUser] = COOKIE_AUTH_DEP):
     """Проверка токена из cookie"""
-    if not KEYCLOAK_ENABLED:
-        return {
-            "valid": True,
-            "username": "anonymous",
-            "email": None,
-            "roles": [],
-            "auth_disabled": True
-        }
-    
     return {
         "valid": True,
         "username": current_user.username,
@@ -218,18 +234,11 @@ async def verify_token(current_user: KeycloakUser = Depends(get_current_user_fro
     }
 
 
-@app.get("/callback")  # ← УБРАЛИ /api/
 async def keycloak_callback(code: str = Query(...)):
     """
     Обмен code на token после редиректа от Keycloak.
     Устанавливает токен в HTTP-only cookie и редиректит на главную.
     """
-    if not KEYCLOAK_ENABLED:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Keycloak authentication is not enabled"
-        )
-    
     try:
         token_data = exchange_code_for_token(code)
         
@@ -262,143 +271,314 @@ async def keycloak_callback(code: str = Query(...)):
     except Exception as e:
         logger.error(f"Keycloak callback error: {e}")
         return RedirectResponse(url="/login?error=auth_failed", status_code=302)
+
+
+# Keycloak-disabled stand-ins with their responses built once
+KEYCLOAK_DISABLED_RESPONSE = ORJSONResponse(
+    {"detail": "Keycloak authentication is not enabled"},
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+)
+LOGOUT_DISABLED_PAYLOAD = {"message": "Keycloak authentication is not enabled"}
+VERIFY_DISABLED_PAYLOAD = {
+    "valid": True,
+    "username": "anonymous",
+    "email": None,
+    "roles": [],
+    "auth_disabled": True
+}
+
+
+async def keycloak_disabled():
+    """Stub for auth endpoints when Keycloak is disabled"""
+    return KEYCLOAK_DISABLED_RESPONSE
+
+
+async def logout_disabled():
+    """Stub for logout when Keycloak is disabled"""
+    return LOGOUT_DISABLED_PAYLOAD
+
+
+async def verify_token_disabled():
+    """Stub for token verification when Keycloak is disabled"""
+    return VERIFY_DISABLED_PAYLOAD
+
+
+# The Keycloak switch is fixed at startup, so register either the real
+# handlers or the stubs once instead of branching on every request
+if KEYCLOAK_ENABLED:
+    app.post("/api/login", response_model=Token)(login)
+    app.post("/api/refresh", response_model=Token)(refresh)
+    app.post("/api/logout")(logout)
+    app.get("/api/verify")(verify_token)
+    app.get("/callback")(keycloak_callback)  # ← УБРАЛИ /api/
+else:
+    app.post("/api/login")(keycloak_disabled)
+    app.post("/api/refresh")(keycloak_disabled)
+    app.post("/api/logout")(logout_disabled)
+    app.get("/api/verify")(verify_token_disabled)
+    app.get("/callback")(keycloak_disabled)
+
+
+# ============ QUERY HELPERS ============
+
+def latest_check_per_node(*criteria):
+    """
+    Latest CertificateCheck per node as an aliased entity.
     
+    Returns the entity and its row number column; join with ``rn == 1`` to
+    keep only the newest check of every node in a single query. Optional
+    criteria restrict which checks are considered (e.g. successful ones).
+    """
+    latest_sq = select(
+        CertificateCheck,
+        func.row_number().over(
+            partition_by=CertificateCheck.node_id,
+            order_by=CertificateCheck.checked_at.desc()
+        ).label("rn")
+    ).where(*criteria).subquery()
+    return aliased(CertificateCheck, latest_sq), latest_sq.c.rn
+
+
+def schema_columns(model, schema: Type[BaseModel]) -> list:
+    """Model columns matching the schema's fields, for column-only selects."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
 # ============ WEB UI ENDPOINTS ============
 
-@app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     """Login page with Keycloak SSO button"""
-    if not KEYCLOAK_ENABLED:
-        # Если Keycloak отключен, редиректим сразу на главную
-        return RedirectResponse(url="/")
-    
-    html_path = Path(__file__).parent.parent / "templates" / "login.html"
-    if html_path.exists():
-        return FileResponse(html_path)
+    if login_html is not None:
+        return Response(login_html, media_type="text/html")
     return HTMLResponse("<h1>Login page not found</h1>", status_code=404)
 
 
-@app.get("/", response_class=HTMLResponse)
-async def dashboard(
-    request: Request, 
-    db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = Depends(get_current_user_from_cookie) if KEYCLOAK_ENABLED else None
-):
-    """Main dashboard page with cookie-based authentication."""
+async def login_page_disabled():
+    """Если Keycloak отключен, редиректим сразу на главную"""
+    return RedirectResponse(url="/")
+
+
+if KEYCLOAK_ENABLED:
+    app.get("/login", response_class=HTMLResponse)(login_page)
+else:
+    app.get("/login")(login_page_disabled)
+
+
+async def _load_dashboard_data(db: AsyncSession) -> dict:
+    """Query data version, active node rows and statistics for the dashboard."""
+    # Data only changes when the scheduler writes, so it is versioned by the
+    # latest node/check timestamps
+    version_result = await db.execute(
+        select(
+            select(func.max(TransportNode.updated_at)).scalar_subquery(),
+            select(func.max(CertificateCheck.checked_at)).scalar_subquery()
+        )
+    )
+    nodes_version, checks_version = version_result.one()
     
-    # Get all active nodes
+    # Get all active nodes together with their latest certificate check.
+    # Rows expose the columns as attributes, so they go to the template as-is.
+    latest_check, latest_rn = latest_check_per_node()
     result = await db.execute(
-        select(TransportNode)
+        select(
+            TransportNode.id,
+            TransportNode.display_name,
+            TransportNode.ip_address,
+            TransportNode.maintenance_mode,
+            TransportNode.last_seen_at,
+            latest_check.cert_expiry_date,
+            latest_check.days_remaining,
+            func.coalesce(latest_check.check_status, 'never_checked').label('check_status'),
+            latest_check.checked_at,
+            latest_check.error_message
+        )
+        .outerjoin(
+            latest_check,
+            and_(latest_check.node_id == TransportNode.id, latest_rn == 1)
+        )
         .where(TransportNode.is_active == True)
         .order_by(TransportNode.display_name)
     )
-    nodes = result.scalars().all()
-    
-    # Get latest certificate check for each node
-    nodes_data = []
-    for node in nodes:
-        # Get latest check for this node
-        check_result = await db.execute(
-            select(CertificateCheck)
-            .where(CertificateCheck.node_id == node.id)
-            .order_by(CertificateCheck.checked_at.desc())
-            .limit(1)
-        )
-        cert_check = check_result.scalar_one_or_none()
-        
-        node_data = {
-            'id': node.id,
-            'display_name': node.display_name,
-            'ip_address': node.ip_address,
-            'maintenance_mode': node.maintenance_mode,
-            'last_seen_at': node.last_seen_at,
-            'cert_expiry_date': cert_check.cert_expiry_date if cert_check else None,
-            'days_remaining': cert_check.days_remaining if cert_check else None,
-            'check_status': cert_check.check_status if cert_check else 'never_checked',
-            'checked_at': cert_check.checked_at if cert_check else None,
-            'error_message': cert_check.error_message if cert_check else None
-        }
-        nodes_data.append(node_data)
+    nodes_data = result.all()
     
-    # Calculate statistics
+    # Calculate statistics in a single pass
     stats = {
         'total_nodes': len(nodes_data),
-        'certs_ok': sum(1 for n in nodes_data if n['days_remaining'] and n['days_remaining'] > 30),
-        'certs_warning': sum(1 for n in nodes_data if n['days_remaining'] and 7 < n['days_remaining'] <= 30),
-        'certs_critical': sum(1 for n in nodes_data if n['days_remaining'] and 0 < n['days_remaining'] <= 7),
-        'certs_expired': sum(1 for n in nodes_data if n['days_remaining'] and n['days_remaining'] <= 0),
-        'certs_error': sum(1 for n in nodes_data if n['check_status'] not in ['success', 'never_checked'])
+        'certs_ok': 0,
+        'certs_warning': 0,
+        'certs_critical': 0,
+        'certs_expired': 0,
+        'certs_error': 0
     }
+    for n in nodes_data:
+        days = n.days_remaining
+        if days:
+            if days > 30:
+                stats['certs_ok'] += 1
+            elif days > 7:
+                stats['certs_warning'] += 1
+            elif days > 0:
+                stats['certs_critical'] += 1
+            else:
+                stats['certs_expired'] += 1
+        if n.check_status not in ('success', 'cached', 'never_checked'):
+            stats['certs_error'] += 1
     
-    # Pass user info to template
-    user_info = {
-        'username': current_user.username if current_user else 'anonymous',
-        'email': current_user.email if current_user else None
+    return {
+        "version": f"{nodes_version}|{checks_version}",
+        "nodes": nodes_data,
+        "stats": stats
     }
+
+
+def _stream_dashboard(data: dict, request: Request, user_info: dict, now: datetime, etag: str):
+    """
+    Render index.html chunk by chunk for loaded dashboard data.
     
-    return templates.TemplateResponse(
-        "index.html",
+    Chunks are sent as soon as Jinja produces them; the complete page is
+    kept in the HTML cache once the render finishes.
+    """
+    chunks = []
+    for chunk in templates.get_template("index.html").generate(
         {
             "request": request,
-            "nodes": nodes_data,
-            "stats": stats,
-            "now": datetime.utcnow(),
+            "nodes": data["nodes"],
+            "stats": data["stats"],
+            "now": now,
             "user": user_info,
             "keycloak_enabled": KEYCLOAK_ENABLED
         }
+    ):
+        chunks.append(chunk)
+        yield chunk
+    
+    if len(_dashboard_html_cache) >= DASHBOARD_HTML_CACHE_SIZE:
+        _dashboard_html_cache.pop(next(iter(_dashboard_html_cache)), None)
+    _dashboard_html_cache[etag] = "".join(chunks)
+
+
+@app.get("/", response_class=HTMLResponse)
+async def dashboard(
+    request: Request, 
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[KeycloakUser] = COOKIE_AUTH_DEP
+):
+    """Main dashboard page with cookie-based authentication."""
+    
+    # Pass user info to template
+    user_info = {
+        'username': current_user.username if current_user else 'anonymous',
+        'email': current_user.email if current_user else None
+    }
+    
+    # Data is cached until the scheduler writes (or the TTL runs out).
+    # Time-relative columns are rendered against a minute-granular "now",
+    # which is part of the page version as well.
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    data = await cache.get_or_compute(
+        "dashboard", DASHBOARD_CACHE_TTL, lambda: _load_dashboard_data(db)
     )
+    etag = '"' + hashlib.blake2b(
+        f"{data['version']}|{now}|{user_info['username']}".encode(),
+        digest_size=8
+    ).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    html = _dashboard_html_cache.get(etag)
+    if html is None:
+        return StreamingResponse(
+            _stream_dashboard(data, request, user_info, now, etag),
+            media_type="text/html",
+            headers=headers
+        )
+    
+    return HTMLResponse(html, headers=headers)
 
 
 # ============ API ENDPOINTS (Protected if Keycloak enabled) ============
 
-def optional_auth():
-    """Optional authentication dependency for API"""
-    if KEYCLOAK_ENABLED:
-        return Depends(get_current_active_user)
-    return None
+def trusted_list_response(rows, schema: Type[BaseModel], cursor_field: Optional[str] = None) -> ORJSONResponse:
+    """
+    Serialize rows with the schema's fields, skipping Pydantic validation.
+    
+    Rows come from our own tables, so re-validating every item is pure
+    overhead; response_model stays on the route for the OpenAPI docs.
+    With cursor_field, the last row's (cursor_field, id) pair is sent in the
+    X-Next-Cursor header as query parameters for the next page
+    (``before=...&before_id=...``).
+    """
+    fields = tuple(schema.model_fields)
+    headers = None
+    if cursor_field and rows:
+        last = rows[-1]
+        headers = {"X-Next-Cursor": urlencode({
+            "before": getattr(last, cursor_field).isoformat(),
+            "before_id": last.id
+        })}
+    return ORJSONResponse(
+        [{name: getattr(row, name) for name in fields} for row in rows],
+        headers=headers
+    )
+
+
+def keyset_before(timestamp_column, id_column, before: Optional[datetime], before_id: Optional[int]):
+    """
+    Condition selecting rows after the cursor in (timestamp, id) DESC order.
+    
+    The id breaks ties between rows written with the same timestamp, so a
+    page boundary inside such a group neither repeats nor skips rows.
+    """
+    if before_id is None:
+        return timestamp_column < before
+    return or_(
+        timestamp_column < before,
+        and_(timestamp_column == before, id_column < before_id)
+    )
 
 
 @app.get("/api/nodes", response_model=List[TransportNodeSchema])
 async def get_nodes(
     active_only: bool = True,
     db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Get list of transport nodes."""
-    query = select(TransportNode)
+    query = select(*schema_columns(TransportNode, TransportNodeSchema))
     if active_only:
         query = query.where(TransportNode.is_active == True)
     query = query.order_by(TransportNode.display_name)
     
     result = await db.execute(query)
-    nodes = result.scalars().all()
-    return nodes
+    nodes = result.all()
+    return trusted_list_response(nodes, TransportNodeSchema)
 
 
 @app.get("/api/nodes/{node_id}", response_model=NodeDetailSchema)
 async def get_node_detail(
     node_id: str, 
     db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Get detailed information about a specific node."""
-    # Get node
+    # Node and its latest certificate check in one round trip
+    latest_check, latest_rn = latest_check_per_node(CertificateCheck.node_id == node_id)
     result = await db.execute(
-        select(TransportNode).where(TransportNode.id == node_id)
+        select(TransportNode, latest_check)
+        .outerjoin(
+            latest_check,
+            and_(latest_check.node_id == TransportNode.id, latest_rn == 1)
+        )
+        .where(TransportNode.id == node_id)
     )
-    node = result.scalar_one_or_none()
+    row = result.one_or_none()
     
-    if not node:
+    if not row:
         return {"error": "Node not found"}, 404
     
-    # Get latest certificate check
-    result = await db.execute(
-        select(CertificateCheck)
-        .where(CertificateCheck.node_id == node_id)
-        .order_by(CertificateCheck.checked_at.desc())
-        .limit(1)
-    )
-    latest_check = result.scalar_one_or_none()
+    node, latest_check = row
     
     return {
         "node": node,
@@ -410,111 +590,108 @@ async def get_node_detail(
 async def get_node_checks(
     node_id: str,
     limit: int = 50,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
-    """Get certificate check history for a node."""
+    """Get certificate check history for a node (keyset-paginated by checked_at, id)."""
+    query = select(*schema_columns(CertificateCheck, CertificateCheckSchema)).where(
+        CertificateCheck.node_id == node_id
+    )
+    if before is not None:
+        query = query.where(
+            keyset_before(CertificateCheck.checked_at, CertificateCheck.id, before, before_id)
+        )
     result = await db.execute(
-        select(CertificateCheck)
-        .where(CertificateCheck.node_id == node_id)
-        .order_by(CertificateCheck.checked_at.desc())
-        .limit(limit)
+        query.order_by(CertificateCheck.checked_at.desc(), CertificateCheck.id.desc()).limit(limit)
     )
-    checks = result.scalars().all()
-    return checks
+    checks = result.all()
+    return trusted_list_response(checks, CertificateCheckSchema, cursor_field="checked_at")
 
 
 @app.get("/api/events", response_model=List[NodeEventSchema])
 async def get_events(
     limit: int = 100, 
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
-    """Get recent node events."""
+    """Get recent node events (keyset-paginated by created_at, id)."""
+    query = select(*schema_columns(NodeEvent, NodeEventSchema))
+    if before is not None:
+        query = query.where(keyset_before(NodeEvent.created_at, NodeEvent.id, before, before_id))
     result = await db.execute(
-        select(NodeEvent)
-        .order_by(NodeEvent.created_at.desc())
-        .limit(limit)
+        query.order_by(NodeEvent.created_at.desc(), NodeEvent.id.desc()).limit(limit)
     )
-    events = result.scalars().all()
-    return events
+    events = result.all()
+    return trusted_list_response(events, NodeEventSchema, cursor_field="created_at")
 
 
 @app.get("/api/stats", response_model=DashboardStatsSchema)
 async def get_stats(
     db: AsyncSession = Depends(get_db),
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Get dashboard statistics."""
-    
-    # Count nodes
-    total_result = await db.execute(select(func.count(TransportNode.id)))
-    total_nodes = total_result.scalar()
-    
-    active_result = await db.execute(
-        select(func.count(TransportNode.id))
-        .where(TransportNode.is_active == True)
-    )
-    active_nodes = active_result.scalar()
-    
-    # Get latest checks for active nodes
-    query = (
-        select(CertificateCheck)
-        .join(TransportNode, CertificateCheck.node_id == TransportNode.id)
-        .where(TransportNode.is_active == True)
-        .where(CertificateCheck.check_status == 'success')
-        .order_by(CertificateCheck.checked_at.desc())
-    )
-    result = await db.execute(query)
-    checks = result.scalars().all()
-    
-    # Get unique latest check per node
-    node_latest = {}
-    for check in checks:
-        if check.node_id not in node_latest:
-            node_latest[check.node_id] = check
-    
-    # Count by expiry status
-    certs_expiring_soon = sum(
-        1 for c in node_latest.values()
-        if c.days_remaining is not None and 7 < c.days_remaining <= 30
-    )
-    certs_expiring_very_soon = sum(
-        1 for c in node_latest.values()
-        if c.days_remaining is not None and 0 < c.days_remaining <= 7
-    )
-    certs_expired = sum(
-        1 for c in node_latest.values()
-        if c.days_remaining is not None and c.days_remaining <= 0
+    return await cache.get_or_compute("stats", DASHBOARD_CACHE_TTL, lambda: _load_stats(db))
+
+
+async def _load_stats(db: AsyncSession) -> dict:
+    """Compute dashboard statistics."""
+    # One aggregate row: node counts plus expiry buckets over the latest
+    # successful (or cached) check of each active node
+    latest_check, latest_rn = latest_check_per_node(
+        CertificateCheck.check_status.in_(('success', 'cached'))
     )
-    
-    # Get last check times
-    last_cert_check = max((c.checked_at for c in checks), default=None)
-    
-    # Get last NSX sync (last time a node was updated)
-    last_update_result = await db.execute(
-        select(func.max(TransportNode.last_seen_at))
+    bucket = latest_check.expiry_bucket
+    is_active = TransportNode.is_active == True
+    result = await db.execute(
+        select(
+            func.count(TransportNode.id).label("total_nodes"),
+            func.count(TransportNode.id).filter(is_active).label("active_nodes"),
+            func.count(latest_check.id).filter(is_active, bucket == 'warning')
+            .label("certs_expiring_soon"),
+            func.count(latest_check.id).filter(is_active, bucket == 'critical')
+            .label("certs_expiring_very_soon"),
+            func.count(latest_check.id).filter(is_active, bucket == 'expired').label("certs_expired"),
+            # Last NSX sync (last time a node was updated)
+            func.max(TransportNode.last_seen_at).label("last_nsx_sync"),
+            func.max(latest_check.checked_at).filter(is_active).label("last_cert_check")
+        )
+        .outerjoin(
+            latest_check,
+            and_(latest_check.node_id == TransportNode.id, latest_rn == 1)
+        )
     )
-    last_nsx_sync = last_update_result.scalar()
+    row = result.one()
     
     return {
-        "total_nodes": total_nodes,
-        "active_nodes": active_nodes,
-        "inactive_nodes": total_nodes - active_nodes,
-        "certs_expiring_soon": certs_expiring_soon,
-        "certs_expiring_very_soon": certs_expiring_very_soon,
-        "certs_expired": certs_expired,
-        "last_nsx_sync": last_nsx_sync,
-        "last_cert_check": last_cert_check
+        "total_nodes": row.total_nodes,
+        "active_nodes": row.active_nodes,
+        "inactive_nodes": row.total_nodes - row.active_nodes,
+        "certs_expiring_soon": row.certs_expiring_soon,
+        "certs_expiring_very_soon": row.certs_expiring_very_soon,
+        "certs_expired": row.certs_expired,
+        "last_nsx_sync": row.last_nsx_sync,
+        "last_cert_check": row.last_cert_check
     }
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
+    payload = await cache.get_or_compute("health", HEALTH_CACHE_TTL, _health_payload)
+    # Pool counters are read live so exhaustion shows up immediately
+    return {**payload, "db_pool": engine.pool.status()}
+
+
+async def _health_payload() -> dict:
+    """Build health check payload."""
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow(),
+        "timestamp": datetime.now(timezone.utc),
         "scheduler_running": scheduler_service is not None,
         "keycloak_enabled": KEYCLOAK_ENABLED
     }
@@ -522,16 +699,21 @@ async def health_check():
 
 @app.post("/api/trigger/cert-check")
 async def trigger_cert_check(
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Manually trigger certificate check."""
     if scheduler_service:
+        if not scheduler_service.run_in_background(scheduler_service.check_certificates):
+            return {
+                "status": "already_running",
+                "message": "Certificate check is already running",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
         logger.info("Manual certificate check triggered via API")
-        asyncio.create_task(scheduler_service.check_certificates())
         return {
             "status": "triggered",
             "message": "Certificate check started in background",
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
     return {
         "status": "error",
@@ -541,16 +723,23 @@ async def trigger_cert_check(
 
 @app.post("/api/trigger/nsx-sync")
 async def trigger_nsx_sync(
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Manually trigger NSX sync."""
     if scheduler_service:
+        # A manual sync should see the current NSX state, not the cached list
+        scheduler_service.nsx_client.invalidate_cache()
+        if not scheduler_service.run_in_background(scheduler_service.sync_nsx_nodes):
+            return {
+                "status": "already_running",
+                "message": "NSX sync is already running",
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
         logger.info("Manual NSX sync triggered via API")
-        asyncio.create_task(scheduler_service.sync_nsx_nodes())
         return {
             "status": "triggered",
             "message": "NSX sync started in background",
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
     return {
         "status": "error",
@@ -560,25 +749,16 @@ async def trigger_nsx_sync(
 
 @app.get("/api/scheduler/status")
 async def scheduler_status(
-    current_user: KeycloakUser = optional_auth()
+    current_user: Optional[KeycloakUser] = AUTH_DEP
 ):
     """Get scheduler status and next run times."""
     if not scheduler_service:
         return {"status": "error", "message": "Scheduler not running"}, 503
     
-    jobs_info = []
-    for job in scheduler_service.scheduler.get_jobs():
-        jobs_info.append({
-            "id": job.id,
-            "name": job.name,
-            "next_run": job.next_run_time.isoformat() if job.next_run_time else None,
-            "trigger": str(job.trigger)
-        })
-    
     return {
         "status": "running",
-        "jobs": jobs_info,
-        "timestamp": datetime.utcnow().isoformat()
+        "jobs": scheduler_service.jobs_summary,
+        "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
 
@@ -1,6 +1,6 @@
 """Database models for ETN monitoring."""
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, Text, ForeignKey, UniqueConstraint, Index, case
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -9,6 +9,9 @@ Base = declarative_base()
 class TransportNode(Base):
     """Edge Transport Node from NSX-T."""
     __tablename__ = 'transport_nodes'
+    __table_args__ = (
+        Index('ix_node_active_name', 'is_active', 'display_name'),
+    )
     
     id = Column(String, primary_key=True)  # node_id from NSX
     display_name = Column(String, nullable=False)
@@ -17,6 +20,7 @@ class TransportNode(Base):
     first_seen_at = Column(DateTime, default=datetime.utcnow)
     last_seen_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    latest_cert_expiry = Column(DateTime, index=True)  # from the latest successful certificate check
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -29,6 +33,19 @@ class TransportNode(Base):
         return f"<TransportNode(id={self.id}, name={self.display_name}, ip={self.ip_address})>"
 
 
+# Expiry buckets of successful checks: first bucket whose threshold
+# days_remaining exceeds, otherwise 'expired'
+EXPIRY_BUCKET_THRESHOLDS = (('ok', 30), ('warning', 7), ('critical', 0))
+
+
+def expiry_bucket(days_remaining: int) -> str:
+    """Expiry bucket for a successful check's days_remaining."""
+    for bucket, threshold in EXPIRY_BUCKET_THRESHOLDS:
+        if days_remaining > threshold:
+            return bucket
+    return 'expired'
+
+
 class CertificateCheck(Base):
     """Certificate check history."""
     __tablename__ = 'certificate_checks'
@@ -37,13 +54,29 @@ class CertificateCheck(Base):
     node_id = Column(String, ForeignKey('transport_nodes.id'), nullable=False)
     cert_expiry_date = Column(DateTime, nullable=True)  # ✅ FIXED: Can be NULL if check failed
     days_remaining = Column(Integer, nullable=False)
-    check_status = Column(String, nullable=False)  # success, error, timeout, ssh_failed
+    check_status = Column(String, nullable=False)  # success, cached, error, timeout, ssh_failed
     error_message = Column(Text)
+    expiry_bucket = Column(String(8), index=True)  # ok, warning, critical, expired; NULL unless success or cached
     checked_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship
     node = relationship("TransportNode", back_populates="certificate_checks")
     
+    # Latest check per node: index seek instead of a sort;
+    # checked_at alone serves global ordering and max(checked_at)
+    __table_args__ = (
+        Index('ix_cert_node_checked', node_id, checked_at.desc()),
+        Index('ix_cc_checked_at', checked_at),
+    )
+    
+    @classmethod
+    def expiry_bucket_expr(cls):
+        """SQL equivalent of expiry_bucket() over days_remaining."""
+        return case(
+            *[(cls.days_remaining > threshold, bucket) for bucket, threshold in EXPIRY_BUCKET_THRESHOLDS],
+            else_='expired'
+        )
+    
     def __repr__(self):
         return f"<CertificateCheck(node_id={self.node_id}, days_remaining={self.days_remaining}, status={self.check_status})>"
 
@@ -62,6 +95,11 @@ class NodeEvent(Base):
     # Relationship
     node = relationship("TransportNode", back_populates="events")
     
+    # Recent events listing (ORDER BY created_at DESC)
+    __table_args__ = (
+        Index('ix_ne_created_at', created_at),
+    )
+    
     def __repr__(self):
         return f"<NodeEvent(node_id={self.node_id}, type={self.event_type}, at={self.created_at})>"
 
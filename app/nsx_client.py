@@ -1,37 +1,39 @@
 """NSX-T Manager API client."""
-import requests
+import httpx
 import logging
+import orjson
 from typing import List, Dict, Optional
-from requests.auth import HTTPBasicAuth
+from app import cache
 from app.config import config
 
 logger = logging.getLogger(__name__)
 
 
 class NSXClient:
-    """Client for NSX-T Manager API."""
+    """Async client for NSX-T Manager API (one kept-alive connection pool per process)."""
+    
+    TRANSPORT_NODES_CACHE_TTL = 60  # seconds
     
     def __init__(self):
         self.base_url = config.NSX_MANAGER_URL.rstrip('/')
+        self.transport_nodes_cache_key = f"nsx:transport-nodes:{self.base_url}"
         self.username = config.NSX_USERNAME
         self.password = config.NSX_PASSWORD
-        self.session = None
         self.cookies = {}
+        self._authenticated = False
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            verify=False,  # Disable SSL verification as requested
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=10),
+            headers={'Content-Type': 'application/json'}
+        )
         
-    def _get_session(self) -> requests.Session:
-        """Get or create authenticated session."""
-        if self.session is None:
-            self.session = requests.Session()
-            self.session.verify = False  # Disable SSL verification as requested
-            
-            # Disable SSL warnings
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            
+    async def _get_session(self) -> httpx.AsyncClient:
+        """Get authenticated client, creating the NSX session on first use."""
+        if not self._authenticated:
             # Authentication using form data (as per NSX-T requirements)
-            auth_url = f"{self.base_url}/api/session/create"
-            
-            # Prepare form data
             auth_data = {
                 'j_username': self.username,
                 'j_password': self.password
@@ -42,12 +44,11 @@ class NSXClient:
                 'Content-Type': 'application/x-www-form-urlencoded'
             }
             
-            response = self.session.post(
-                auth_url,
+            response = await self._client.post(
+                '/api/session/create',
                 data=auth_data,
                 headers=headers,
-                auth=HTTPBasicAuth(self.username, self.password),
-                verify=False
+                auth=httpx.BasicAuth(self.username, self.password)
             )
             
             if response.status_code == 200:
@@ -63,102 +64,115 @@ class NSXClient:
                 else:
                     logger.warning("No X-XSRF-TOKEN in response, trying to continue...")
                     self.cookies = {}
+                self._authenticated = True
             else:
                 logger.error(f"Authentication failed: {response.status_code} - {response.text}")
                 raise Exception(f"Failed to authenticate to NSX-T Manager: {response.status_code}")
                 
-        return self.session
+        return self._client
     
-    def _make_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
         """Make authenticated request to NSX API."""
-        session = self._get_session()
-        url = f"{self.base_url}{endpoint}"
+        client = await self._get_session()
         
         # Set default headers
         headers = kwargs.get('headers', {})
         
-        # Add Content-Type for API requests
-        if 'Content-Type' not in headers:
-            headers['Content-Type'] = 'application/json'
-        
         # Add XSRF token to headers if available
         if self.cookies.get('X-XSRF-TOKEN'):
             headers['X-XSRF-TOKEN'] = self.cookies['X-XSRF-TOKEN']
         
         kwargs['headers'] = headers
         
-        response = session.request(method, url, **kwargs)
+        response = await client.request(method, endpoint, **kwargs)
         
         # Handle session expiration
         if response.status_code == 403:
             logger.warning("Session expired, re-authenticating...")
-            self.session = None
+            self._authenticated = False
             self.cookies = {}
-            return self._make_request(method, endpoint, **kwargs)
+            client.cookies.clear()
+            return await self._make_request(method, endpoint, **kwargs)
             
         return response
     
-    def get_transport_nodes(self) -> List[Dict]:
+    async def get_transport_nodes(self) -> List[Dict]:
         """
         Get all transport nodes from NSX-T Manager.
         
+        The list is cached for TRANSPORT_NODES_CACHE_TTL seconds; concurrent
+        callers share one NSX request.
+        
         Returns:
             List of transport node dictionaries
         """
         try:
-            response = self._make_request('GET', '/api/v1/transport-nodes')
-            
-            if response.status_code == 200:
-                data = response.json()
-                all_nodes = data.get('results', [])
-                logger.info(f"Retrieved {len(all_nodes)} transport nodes from NSX")
-                return all_nodes
-            else:
-                logger.error(f"Failed to get transport nodes: {response.status_code} - {response.text}")
-                return []
-                
+            return await cache.get_or_compute(
+                self.transport_nodes_cache_key,
+                self.TRANSPORT_NODES_CACHE_TTL,
+                self._fetch_transport_nodes
+            )
         except Exception as e:
             logger.error(f"Error getting transport nodes: {str(e)}", exc_info=True)
             return []
     
-    def get_edge_transport_nodes(self) -> List[Dict]:
+    async def _fetch_transport_nodes(self) -> List[Dict]:
+        """Fetch transport nodes from NSX; raises on failure so errors are not cached."""
+        response = await self._make_request('GET', '/api/v1/transport-nodes')
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get transport nodes: {response.status_code} - {response.text}")
+        
+        all_nodes = orjson.loads(response.content).get('results', [])
+        logger.info(f"Retrieved {len(all_nodes)} transport nodes from NSX")
+        return all_nodes
+    
+    def invalidate_cache(self):
+        """Drop the cached transport node list so the next call hits NSX."""
+        cache.invalidate(self.transport_nodes_cache_key)
+    
+    async def get_edge_transport_nodes(self) -> List[Dict]:
         """
         Get only Edge Transport Nodes (ETN) from NSX-T Manager.
         
         Returns:
             List of edge transport node dictionaries with extracted info
         """
-        all_nodes = self.get_transport_nodes()
+        all_nodes = await self.get_transport_nodes()
         
         # Get whitelist from config
-        whitelist = config.get_etn_whitelist()
+        whitelist = config.etn_whitelist
         if whitelist:
-            logger.info(f"ETN Whitelist enabled: {whitelist}")
+            logger.info(f"ETN Whitelist enabled: {sorted(whitelist)}")
+        
+        log_skipped = bool(whitelist) and logger.isEnabledFor(logging.DEBUG)
         
         edge_nodes = []
         for node in all_nodes:
             node_deployment = node.get('node_deployment_info', {})
             
             # Filter only EdgeNode types
-            if node_deployment.get('resource_type') == 'EdgeNode':
-                ip_addresses = node_deployment.get('ip_addresses', [])
-                ip_address = ip_addresses[0] if ip_addresses else None
-                
-                # Apply whitelist filter if configured
-                if whitelist and ip_address not in whitelist:
+            if node_deployment.get('resource_type') != 'EdgeNode':
+                continue
+            
+            ip_addresses = node_deployment.get('ip_addresses')
+            ip_address = ip_addresses[0] if ip_addresses else None
+            if not ip_address:  # Only add if has IP
+                continue
+            
+            # Apply whitelist filter if configured
+            if whitelist and ip_address not in whitelist:
+                if log_skipped:
                     logger.debug(f"Skipping {node.get('display_name')} ({ip_address}) - not in whitelist")
-                    continue
-                
-                edge_node = {
-                    'node_id': node.get('id'),
-                    'display_name': node.get('display_name'),
-                    'ip_address': ip_address,
-                    'maintenance_mode': node.get('maintenance_mode', 'UNKNOWN'),
-                    'hostname': node_deployment.get('node_settings', {}).get('hostname'),
-                }
-                
-                if edge_node['ip_address']:  # Only add if has IP
-                    edge_nodes.append(edge_node)
+                continue
+            
+            edge_nodes.append({
+                'node_id': node.get('id'),
+                'display_name': node.get('display_name'),
+                'ip_address': ip_address,
+                'maintenance_mode': node.get('maintenance_mode', 'UNKNOWN'),
+                'hostname': node_deployment.get('node_settings', {}).get('hostname'),
+            })
         
         if whitelist:
             logger.info(f"Filtered {len(edge_nodes)} Edge Transport Nodes (whitelist applied)")
@@ -166,8 +180,7 @@ class NSXClient:
             logger.info(f"Filtered {len(edge_nodes)} Edge Transport Nodes")
         return edge_nodes
     
-    def close(self):
-        """Close the session."""
-        if self.session:
-            self.session.close()
-            self.session = None
+    async def close(self):
+        """Close the HTTP client and its pooled connections."""
+        await self._client.aclose()
+        self._authenticated = False
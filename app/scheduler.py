@@ -1,16 +1,24 @@
 """Background scheduler for periodic tasks."""
 import asyncio
 import logging
-from datetime import datetime
-from typing import List
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set
+from apscheduler.events import (
+    EVENT_JOB_ADDED, EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED, EVENT_JOB_SUBMITTED,
+    EVENT_SCHEDULER_STARTED
+)
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from sqlalchemy import select, update
+from apscheduler.triggers.date import DateTrigger
+from sqlalchemy import bindparam, func, insert, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import cache
 from app.config import config
-from app.database import AsyncSessionLocal
-from app.models import TransportNode, CertificateCheck, NodeEvent
+from app.database import AsyncSessionLocal, dialect_insert
+from app.models import TransportNode, CertificateCheck, NodeEvent, expiry_bucket
 from app.nsx_client import NSXClient
 from app.ssh_checker import CertificateChecker
 from app.telegram_notifier import TelegramNotifier
@@ -21,12 +29,41 @@ logger = logging.getLogger(__name__)
 class SchedulerService:
     """Manage scheduled background tasks."""
     
+    CHECK_RESULTS_BATCH_SIZE = 200  # certificate check rows per insert/commit
+    DAILY_NOTIFICATIONS_TRIGGER = CronTrigger(hour=10, minute=0)
+    
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
         self.nsx_client = NSXClient()
         self.cert_checker = CertificateChecker()
         self.telegram = TelegramNotifier()
         
+        # Manually triggered runs, at most one in flight per job
+        self._background_tasks: Dict[str, asyncio.Task] = {}
+        
+        # Job summaries for the status endpoint, rebuilt only when jobs change.
+        # next_run_time advances on submission, and a run skipped at
+        # max_instances is never executed, so both events count too
+        self.jobs_summary: List[Dict] = []
+        self.scheduler.add_listener(
+            self._rebuild_jobs_summary,
+            EVENT_SCHEDULER_STARTED | EVENT_JOB_ADDED | EVENT_JOB_MODIFIED |
+            EVENT_JOB_REMOVED | EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES |
+            EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+        )
+        
+    def _rebuild_jobs_summary(self, event=None):
+        """Refresh cached job summaries (id, name, next run, trigger)."""
+        self.jobs_summary = [
+            {
+                "id": job.id,
+                "name": job.name,
+                "next_run": job.next_run_time.isoformat() if job.next_run_time else None,
+                "trigger": str(job.trigger)
+            }
+            for job in self.scheduler.get_jobs()
+        ]
+    
     def start(self):
         """Start the scheduler with configured jobs."""
         
@@ -48,12 +85,16 @@ class SchedulerService:
             replace_existing=True
         )
         
-        # Job 3: Send Telegram notifications (daily at 10:00)
+        # Job 3: Send Telegram notifications (daily at 10:00 while certificates
+        # are in the warning window, see _reschedule_notifications)
+        self._schedule_notifications(self.DAILY_NOTIFICATIONS_TRIGGER)
+        
+        # Job 4: Weekly safety net in case the notification job was moved too far out
         self.scheduler.add_job(
             self.send_expiry_notifications,
-            trigger=CronTrigger(hour=10, minute=0),
-            id='send_notifications',
-            name='Send Certificate Expiry Notifications',
+            trigger=CronTrigger(day_of_week='mon', hour=10, minute=0),
+            id='send_notifications_weekly',
+            name='Send Certificate Expiry Notifications (weekly)',
             replace_existing=True
         )
         
@@ -62,10 +103,25 @@ class SchedulerService:
         for job in self.scheduler.get_jobs():
             logger.info(f"  - {job.name}: {job.trigger}")
     
-    def shutdown(self):
+    def run_in_background(self, job: Callable[[], Awaitable[None]]) -> bool:
+        """
+        Start a job as a background task unless a triggered run is in flight.
+        
+        Returns:
+            False if the previous triggered run of this job is still running
+        """
+        name = job.__name__
+        task = self._background_tasks.get(name)
+        if task is not None and not task.done():
+            return False
+        self._background_tasks[name] = asyncio.create_task(job())
+        return True
+    
+    async def shutdown(self):
         """Shutdown the scheduler."""
         self.scheduler.shutdown()
-        self.nsx_client.close()
+        await self.nsx_client.close()
+        await self.telegram.close()
         logger.info("Scheduler stopped")
     
     async def sync_nsx_nodes(self):
@@ -74,103 +130,110 @@ class SchedulerService:
         
         try:
             # Get current ETN from NSX
-            nsx_nodes = self.nsx_client.get_edge_transport_nodes()
+            nsx_nodes = await self.nsx_client.get_edge_transport_nodes()
             
             if not nsx_nodes:
                 logger.warning("No ETN retrieved from NSX")
                 return
             
             async with AsyncSessionLocal() as db:
-                # Get existing nodes from DB
-                result = await db.execute(select(TransportNode))
-                existing_nodes = {node.id: node for node in result.scalars().all()}
+                nsx_node_ids = [node['node_id'] for node in nsx_nodes]
                 
-                nsx_node_ids = {node['node_id'] for node in nsx_nodes}
-                existing_node_ids = set(existing_nodes.keys())
+                # Known state of the nodes NSX reports (not the whole table)
+                result = await db.execute(
+                    select(TransportNode.id, TransportNode.is_active)
+                    .where(TransportNode.id.in_(nsx_node_ids))
+                )
+                known_active = dict(result.all())
                 
                 # Find new nodes
-                new_node_ids = nsx_node_ids - existing_node_ids
-                # Find removed nodes
-                removed_node_ids = existing_node_ids - nsx_node_ids
+                new_node_ids = set(nsx_node_ids) - known_active.keys()
                 # Find reappeared nodes (was inactive, now active again)
                 reappeared_node_ids = {
-                    nid for nid in nsx_node_ids 
-                    if nid in existing_nodes and not existing_nodes[nid].is_active
+                    nid for nid, is_active in known_active.items() if not is_active
                 }
                 
                 new_nodes = []
-                
-                # Add new nodes
+                event_rows = []
                 for node in nsx_nodes:
                     node_id = node['node_id']
                     
                     if node_id in new_node_ids:
-                        # Brand new node
-                        db_node = TransportNode(
+                        new_nodes.append(TransportNode(
                             id=node_id,
                             display_name=node['display_name'],
-                            ip_address=node['ip_address'],
-                            maintenance_mode=node['maintenance_mode'],
-                            first_seen_at=datetime.utcnow(),
-                            last_seen_at=datetime.utcnow(),
-                            is_active=True
-                        )
-                        db.add(db_node)
-                        new_nodes.append(db_node)
-                        
-                        # Log event
-                        event = NodeEvent(
-                            node_id=node_id,
-                            event_type='added',
-                            display_name=node['display_name'],
                             ip_address=node['ip_address']
-                        )
-                        db.add(event)
+                        ))
+                        event_type = 'added'
                         logger.info(f"New ETN discovered: {node['display_name']} ({node['ip_address']})")
-                        
                     elif node_id in reappeared_node_ids:
-                        # Node came back
-                        existing_node = existing_nodes[node_id]
-                        existing_node.is_active = True
-                        existing_node.last_seen_at = datetime.utcnow()
-                        existing_node.ip_address = node['ip_address']
-                        existing_node.display_name = node['display_name']
-                        existing_node.maintenance_mode = node['maintenance_mode']
-                        
-                        event = NodeEvent(
-                            node_id=node_id,
-                            event_type='reappeared',
-                            display_name=node['display_name'],
-                            ip_address=node['ip_address']
-                        )
-                        db.add(event)
+                        event_type = 'reappeared'
                         logger.info(f"ETN reappeared: {node['display_name']}")
-                        
                     else:
-                        # Update existing node
-                        existing_node = existing_nodes[node_id]
-                        existing_node.last_seen_at = datetime.utcnow()
-                        existing_node.ip_address = node['ip_address']
-                        existing_node.display_name = node['display_name']
-                        existing_node.maintenance_mode = node['maintenance_mode']
-                
-                # Mark removed nodes as inactive
-                removed_nodes = []
-                for node_id in removed_node_ids:
-                    node = existing_nodes[node_id]
-                    node.is_active = False
-                    removed_nodes.append(node)
+                        continue
                     
-                    event = NodeEvent(
-                        node_id=node_id,
-                        event_type='removed',
-                        display_name=node.display_name,
-                        ip_address=node.ip_address
+                    event_rows.append({
+                        'node_id': node_id,
+                        'event_type': event_type,
+                        'display_name': node['display_name'],
+                        'ip_address': node['ip_address']
+                    })
+                
+                # Insert new nodes and refresh existing ones in one UPSERT
+                upsert = dialect_insert(TransportNode)
+                await db.execute(
+                    upsert.on_conflict_do_update(
+                        index_elements=[TransportNode.id],
+                        set_={
+                            'display_name': upsert.excluded.display_name,
+                            'ip_address': upsert.excluded.ip_address,
+                            'maintenance_mode': upsert.excluded.maintenance_mode,
+                            'is_active': True,
+                            'last_seen_at': upsert.excluded.last_seen_at,
+                            'updated_at': upsert.excluded.updated_at
+                        }
+                    ),
+                    [
+                        {
+                            'id': node['node_id'],
+                            'display_name': node['display_name'],
+                            'ip_address': node['ip_address'],
+                            'maintenance_mode': node['maintenance_mode'],
+                            'is_active': True
+                        }
+                        for node in nsx_nodes
+                    ]
+                )
+                
+                # Mark active nodes missing from NSX as inactive
+                result = await db.execute(
+                    update(TransportNode.__table__)
+                    .where(
+                        TransportNode.__table__.c.is_active == True,
+                        TransportNode.__table__.c.id.not_in(nsx_node_ids)
                     )
-                    db.add(event)
+                    .values(is_active=False)
+                    .returning(
+                        TransportNode.__table__.c.id,
+                        TransportNode.__table__.c.display_name,
+                        TransportNode.__table__.c.ip_address
+                    )
+                )
+                removed_nodes = result.all()
+                for node in removed_nodes:
+                    event_rows.append({
+                        'node_id': node.id,
+                        'event_type': 'removed',
+                        'display_name': node.display_name,
+                        'ip_address': node.ip_address
+                    })
                     logger.warning(f"ETN removed from NSX: {node.display_name}")
                 
+                if event_rows:
+                    await db.execute(insert(NodeEvent), event_rows)
+                
                 await db.commit()
+                cache.invalidate('dashboard', 'stats')
                 
                 logger.info(
                     f"NSX sync completed: {len(new_nodes)} new, "
@@ -180,24 +243,54 @@ class SchedulerService:
                 
                 # Send Telegram notifications
                 if new_nodes:
-                    await self.telegram.notify_new_nodes(new_nodes)
+                    self.telegram.notify_new_nodes(new_nodes)
                 if removed_nodes:
-                    await self.telegram.notify_removed_nodes(removed_nodes)
+                    self.telegram.notify_removed_nodes(removed_nodes)
+                self.telegram.flush()
                 
         except Exception as e:
             logger.error(f"Error syncing NSX nodes: {str(e)}", exc_info=True)
     
-    async def check_certificates(self):
-        """Check SSL certificates on all active ETN."""
+    async def check_certificates(self, node_ids: Optional[Collection[str]] = None):
+        """
+        Check SSL certificates on all active ETN.
+        
+        Args:
+            node_ids: Restrict the check to these nodes (all active nodes if None)
+        """
         logger.info("Starting certificate checks...")
         
         try:
             async with AsyncSessionLocal() as db:
-                # Get all active nodes
-                result = await db.execute(
-                    select(TransportNode).where(TransportNode.is_active == True)
+                # Get all active nodes, with the last verified expiry to seed
+                # the checker's cache after a restart
+                verified_at = (
+                    select(func.max(CertificateCheck.checked_at))
+                    .where(
+                        CertificateCheck.node_id == TransportNode.id,
+                        CertificateCheck.check_status == 'success'
+                    )
+                    .scalar_subquery()
+                )
+                query = (
+                    select(
+                        TransportNode.id,
+                        TransportNode.ip_address,
+                        TransportNode.latest_cert_expiry,
+                        verified_at.label('verified_at')
+                    )
+                    .where(TransportNode.is_active == True)
                 )
-                nodes = result.scalars().all()
+                if node_ids is not None:
+                    query = query.where(TransportNode.id.in_(node_ids))
+                if not config.CERT_CHECK_MAINTENANCE_NODES:
+                    # Maintenance-mode nodes would only burn SSH timeouts
+                    query = query.where(or_(
+                        TransportNode.maintenance_mode.is_(None),
+                        TransportNode.maintenance_mode != 'ENABLED'
+                    ))
+                result = await db.execute(query)
+                nodes = result.all()
                 
                 if not nodes:
                     logger.warning("No active ETN found in database")
@@ -205,38 +298,86 @@ class SchedulerService:
                 
                 # Prepare host list for parallel checking
                 hosts = [
-                    {'host': node.ip_address, 'node_id': node.id}
+                    {
+                        'host': node.ip_address,
+                        'node_id': node.id,
+                        'cert_expiry': node.latest_cert_expiry,
+                        'verified_at': node.verified_at
+                    }
                     for node in nodes
                 ]
                 
-                # Check certificates in parallel
-                check_results = await self.cert_checker.check_multiple_certificates(hosts)
-                
-                # Save results to database
-                for result in check_results:
-                    check_record = CertificateCheck(
-                        node_id=result['node_id'],
-                        cert_expiry_date=result['cert_expiry_date'],
-                        days_remaining=result['days_remaining'] if result['cert_expiry_date'] else -999,
-                        check_status=result['status'],
-                        error_message=result.get('error_message')
-                    )
-                    db.add(check_record)
-                
-                await db.commit()
+                # Check certificates in parallel, saving results in batches as
+                # they arrive so database writes overlap the remaining SSH checks
+                batch = []
+                total_count = 0
+                success_count = 0
+                # aclosing() cancels the remaining SSH checks as soon as the loop
+                # exits, instead of whenever the generator is garbage-collected
+                async with aclosing(self.cert_checker.iter_certificate_checks(hosts)) as check_results:
+                    async for check_result in check_results:
+                        batch.append(check_result)
+                        total_count += 1
+                        if check_result['status'] in ('success', 'cached'):
+                            success_count += 1
+                        if len(batch) >= self.CHECK_RESULTS_BATCH_SIZE:
+                            await self._save_check_results(db, batch)
+                            batch = []
+                if batch:
+                    await self._save_check_results(db, batch)
                 
                 # Log summary
-                success_count = sum(1 for r in check_results if r['status'] == 'success')
                 logger.info(
-                    f"Certificate check completed: {success_count}/{len(check_results)} successful"
+                    f"Certificate check completed: {success_count}/{total_count} successful"
                 )
                 
                 # Send notifications for expiring certs
                 await self.telegram.check_and_notify_expiring_certs(db)
+                await self._reschedule_notifications(db)
                 
         except Exception as e:
             logger.error(f"Error checking certificates: {str(e)}", exc_info=True)
     
+    async def _save_check_results(self, db: AsyncSession, check_results: List[Dict]):
+        """Insert a batch of certificate check results and commit it."""
+        # Save results to database in one multi-row insert
+        await db.execute(
+            insert(CertificateCheck),
+            [
+                {
+                    'node_id': result['node_id'],
+                    'cert_expiry_date': result['cert_expiry_date'],
+                    'days_remaining': result['days_remaining'] if result['cert_expiry_date'] else -999,
+                    'check_status': result['status'],
+                    'error_message': result.get('error_message'),
+                    'expiry_bucket': (
+                        expiry_bucket(result['days_remaining'])
+                        if result['status'] in ('success', 'cached') else None
+                    )
+                }
+                for result in check_results
+            ]
+        )
+        
+        # Keep the latest known expiry on the node for the notifier (cached
+        # results only repeat it)
+        expiry_rows = [
+            {'b_id': result['node_id'], 'b_expiry': result['cert_expiry_date']}
+            for result in check_results
+            if result['status'] == 'success'
+        ]
+        if expiry_rows:
+            await db.execute(
+                update(TransportNode.__table__)
+                .where(TransportNode.__table__.c.id == bindparam('b_id'))
+                .values(latest_cert_expiry=bindparam('b_expiry')),
+                expiry_rows
+            )
+        
+        # Commit per batch so the write lock isn't held while SSH checks run
+        await db.commit()
+        cache.invalidate('dashboard', 'stats')
+    
     async def send_expiry_notifications(self):
         """Send Telegram notifications for expiring certificates."""
         logger.info("Checking for expiring certificates...")
@@ -244,14 +385,81 @@ class SchedulerService:
         try:
             async with AsyncSessionLocal() as db:
                 await self.telegram.check_and_notify_expiring_certs(db)
+                await self._reschedule_notifications(db)
         except Exception as e:
             logger.error(f"Error sending notifications: {str(e)}", exc_info=True)
     
+    def _schedule_notifications(self, trigger):
+        """(Re)create the notification job with the given trigger."""
+        self.scheduler.add_job(
+            self.send_expiry_notifications,
+            trigger=trigger,
+            id='send_notifications',
+            name='Send Certificate Expiry Notifications',
+            replace_existing=True
+        )
+    
+    async def _reschedule_notifications(self, db: AsyncSession):
+        """
+        Poll daily only while some certificate is in the warning window.
+        
+        Otherwise the notification job becomes a one-shot run on the day the
+        earliest certificate enters the window; that run switches back to
+        daily. Certificate checks and the weekly job re-evaluate this.
+        """
+        result = await db.execute(
+            select(func.min(TransportNode.latest_cert_expiry))
+            .where(TransportNode.is_active == True)
+        )
+        earliest_expiry = result.scalar_one()
+        
+        if earliest_expiry is None:
+            # Nothing known to expire; the weekly job still runs
+            if self.scheduler.get_job('send_notifications'):
+                self.scheduler.remove_job('send_notifications')
+            logger.info("No certificate expiry known, daily notifications paused")
+            return
+        
+        window_start = earliest_expiry - timedelta(days=max(config.CERT_WARNING_DAYS, 7) + 1)
+        if window_start <= datetime.utcnow():
+            self._schedule_notifications(self.DAILY_NOTIFICATIONS_TRIGGER)
+        else:
+            self._schedule_notifications(
+                DateTrigger(run_date=window_start.replace(tzinfo=timezone.utc))
+            )
+            logger.info(f"Next expiry notification check scheduled for {window_start} UTC")
+    
+    async def _active_node_ids(self) -> Set[str]:
+        """Ids of the currently active nodes."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(TransportNode.id).where(TransportNode.is_active == True)
+            )
+            return set(result.scalars().all())
+    
     async def run_initial_sync(self):
         """Run initial sync on startup."""
-        logger.info("Running initial NSX sync on startup...")
-        await self.sync_nsx_nodes()
+        known_node_ids = await self._active_node_ids()
+        
+        if not known_node_ids:
+            # Fresh database: nothing to check until NSX has been synced
+            logger.info("Running initial NSX sync on startup...")
+            await self.sync_nsx_nodes()
+            
+            # ✅ ДОБАВЛЕНО: Запустить проверку сертификатов сразу после синхронизации
+            logger.info("Running initial certificate check on startup...")
+            await self.check_certificates()
+            return
+        
+        # NSX sync and SSH checks of already known nodes are independent I/O,
+        # so run them side by side and then top up with newly discovered nodes
+        logger.info("Running initial NSX sync and certificate check on startup...")
+        await asyncio.gather(
+            self.sync_nsx_nodes(),
+            self.check_certificates(node_ids=known_node_ids)
+        )
         
-        # ✅ ДОБАВЛЕНО: Запустить проверку сертификатов сразу после синхронизации
-        logger.info("Running initial certificate check on startup...")
-        await self.check_certificates()
\ No newline at end of file
+        new_node_ids = await self._active_node_ids() - known_node_ids
+        if new_node_ids:
+            logger.info(f"Checking certificates of {len(new_node_ids)} newly discovered ETN...")
+            await self.check_certificates(node_ids=new_node_ids)
\ No newline at end of file
@@ -2,35 +2,81 @@
 import asyncio
 import asyncssh
 import logging
-from datetime import datetime
-from typing import Dict, Optional
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Optional, Tuple
 from app.config import config
 
 logger = logging.getLogger(__name__)
 
+# openssl always prints English month abbreviations, whatever the locale
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
 
 class CertificateChecker:
     """Check SSL certificates on ETN hosts via SSH."""
     
     CERT_PATH = '/etc/vmware/nsx/host-cert.pem'
     OPENSSL_CMD = f'openssl x509 -enddate -noout -in {CERT_PATH}'
+    # Cached expiry dates are trusted for this long, and only while the
+    # certificate is outside the warning window
+    EXPIRY_CACHE_MAX_AGE = timedelta(days=30)
+    # Unreachable hosts are not retried for this long, so back-to-back runs
+    # don't each wait out the full SSH timeout again
+    FAILURE_CACHE_TTL = timedelta(minutes=5)
     
     def __init__(self):
         self.username = config.ETN_SSH_USERNAME
         self.password = config.ETN_SSH_PASSWORD
         self.port = config.ETN_SSH_PORT
         self.timeout = config.ETN_SSH_TIMEOUT
+        # Shared by all runs so overlapping checks stay within the limit too
+        self._sem = asyncio.Semaphore(config.ETN_SSH_MAX_CONCURRENCY)
+        # host -> (expiry_date, cached_at) of the last successful check
+        self._expiry_cache: Dict[str, Tuple[datetime, datetime]] = {}
+        self._recheck_window = timedelta(days=max(config.CERT_WARNING_DAYS, 14))
+        # host -> (status, error_message, retry_after) of a recent connection failure
+        self._failure_cache: Dict[str, Tuple[str, str, datetime]] = {}
+        # Connection options are validated once and shared by every connection
+        self._ssh_options = asyncssh.SSHClientConnectionOptions(
+            username=self.username,
+            password=self.password,
+            known_hosts=None,  # Don't check host keys
+            connect_timeout=self.timeout,
+            login_timeout=self.timeout
+        )
+    
+    def _cached_expiry(self, host: str, now: datetime) -> Optional[datetime]:
+        """Cached expiry date if it is fresh and far enough from expiring."""
+        cached = self._expiry_cache.get(host)
+        if cached is None:
+            return None
+        expiry_date, cached_at = cached
+        if now - cached_at > self.EXPIRY_CACHE_MAX_AGE or expiry_date - now <= self._recheck_window:
+            return None
+        return expiry_date
     
-    async def check_certificate(self, host: str, node_id: str) -> Dict:
+    async def check_certificate(
+        self,
+        host: str,
+        node_id: str,
+        known_expiry: Optional[datetime] = None,
+        verified_at: Optional[datetime] = None
+    ) -> Dict:
         """
         Check certificate expiration date on a single host.
         
         Args:
             host: IP address or hostname
             node_id: Node ID for logging
+            known_expiry: Expiry date stored by the last successful check
+            verified_at: When that check ran
             
         Returns:
-            Dict with check results
+            Dict with check results; status 'cached' when the expiry date
+            came from the cache instead of the host
         """
         result = {
             'node_id': node_id,
@@ -41,25 +87,43 @@ class CertificateChecker:
             'error_message': None
         }
         
+        # After a restart the cache starts from the last stored successful check
+        if known_expiry is not None and verified_at is not None:
+            self._expiry_cache.setdefault(host, (known_expiry, verified_at))
+        
+        # Certificates far from expiry don't need an SSH round trip every run
+        now = datetime.utcnow()
+        cached_expiry = self._cached_expiry(host, now)
+        if cached_expiry is not None:
+            time_remaining = cached_expiry - now
+            result.update({
+                'status': 'cached',
+                'cert_expiry_date': cached_expiry,
+                'days_remaining': time_remaining.days,
+                'total_seconds': int(time_remaining.total_seconds())
+            })
+            logger.debug("Using cached certificate expiry for %s: %s", host, cached_expiry)
+            return result
+        
+        failure = self._failure_cache.get(host)
+        if failure is not None:
+            if failure[2] > now:
+                result['status'], result['error_message'] = failure[0], failure[1]
+                logger.debug("Skipping %s, failed recently: %s", host, failure[1])
+                return result
+            del self._failure_cache[host]
+        
         try:
-            logger.debug(f"Connecting to {host} (node: {node_id})...")
+            logger.debug("Connecting to %s (node: %s)...", host, node_id)
             
-            async with asyncssh.connect(
-                host,
-                username=self.username,
-                password=self.password,
-                port=self.port,
-                known_hosts=None,  # Don't check host keys
-                connect_timeout=self.timeout,
-                login_timeout=self.timeout
-            ) as conn:
+            async with asyncssh.connect(host, port=self.port, options=self._ssh_options) as conn:
                 
                 # Execute openssl command
                 ssh_result = await conn.run(self.OPENSSL_CMD, check=False, timeout=10)
                 
                 if ssh_result.exit_status != 0:
                     error_msg = f"Command failed: {ssh_result.stderr}"
-                    logger.error(f"Failed to read certificate on {host}: {error_msg}")
+                    logger.error("Failed to read certificate on %s: %s", host, error_msg)
                     result['error_message'] = error_msg
                     result['status'] = 'error'
                     return result
@@ -70,6 +134,7 @@ class CertificateChecker:
                 
                 if expiry_date:
                     now = datetime.utcnow()
+                    self._expiry_cache[host] = (expiry_date, now)
                     time_remaining = expiry_date - now
                     
                     # ✅ ИСПРАВЛЕНИЕ: Используем total_seconds() для точного расчета
@@ -96,43 +161,48 @@ class CertificateChecker:
                         hours_remaining = int(total_seconds // 3600)
                         if days_remaining > 0:
                             logger.info(
-                                f"Certificate on {host} expires in {days_remaining} days "
-                                f"({hours_remaining} hours) - {expiry_date}"
+                                "Certificate on %s expires in %d days (%d hours) - %s",
+                                host, days_remaining, hours_remaining, expiry_date
                             )
                         else:
                             # Осталось меньше суток, но сертификат еще действителен
                             logger.info(
-                                f"Certificate on {host} expires in {hours_remaining} hours "
-                                f"(less than 1 day) - {expiry_date}"
+                                "Certificate on %s expires in %d hours (less than 1 day) - %s",
+                                host, hours_remaining, expiry_date
                             )
                     else:
                         # Сертификат реально истек
                         days_expired = abs(days_remaining)
                         hours_expired = abs(int(total_seconds // 3600))
                         logger.warning(
-                            f"Certificate on {host} EXPIRED {days_expired} days ago "
-                            f"({hours_expired} hours) - {expiry_date}"
+                            "Certificate on %s EXPIRED %d days ago (%d hours) - %s",
+                            host, days_expired, hours_expired, expiry_date
                         )
                 else:
+                    self._expiry_cache.pop(host, None)
                     result['error_message'] = f"Failed to parse date from: {output}"
                     result['status'] = 'error'
-                    logger.error(f"Failed to parse certificate date on {host}: {output}")
+                    logger.error("Failed to parse certificate date on %s: %s", host, output)
                 
         except asyncssh.Error as e:
             error_msg = f"SSH connection error: {str(e)}"
-            logger.error(f"SSH error for {host}: {error_msg}")
+            logger.warning("SSH error for %s: %s", host, error_msg)
             result['error_message'] = error_msg
             result['status'] = 'ssh_failed'
+            self._failure_cache[host] = ('ssh_failed', error_msg, datetime.utcnow() + self.FAILURE_CACHE_TTL)
             
         except asyncio.TimeoutError:
             error_msg = f"Connection timeout after {self.timeout}s"
-            logger.error(f"Timeout connecting to {host}")
+            logger.info("Timeout connecting to %s", host)
             result['error_message'] = error_msg
             result['status'] = 'timeout'
+            self._failure_cache[host] = ('timeout', error_msg, datetime.utcnow() + self.FAILURE_CACHE_TTL)
             
         except Exception as e:
             error_msg = f"Unexpected error: {str(e)}"
-            logger.error(f"Unexpected error checking {host}: {error_msg}", exc_info=True)
+            # Tracebacks only at DEBUG: failures come in bursts across the fan-out
+            logger.warning("Unexpected error checking %s: %s", host, error_msg)
+            logger.debug("Traceback for %s", host, exc_info=True)
             result['error_message'] = error_msg
             result['status'] = 'error'
         
@@ -160,56 +230,62 @@ class CertificateChecker:
             if date_str.endswith(' GMT'):
                 date_str = date_str[:-4].strip()
             
-            # Parse date: "Dec 31 23:59:59 2025"
-            # Format: %b %d %H:%M:%S %Y
-            date_obj = datetime.strptime(date_str, '%b %d %H:%M:%S %Y')
+            # Parse date: "Dec 31 23:59:59 2025" (day may be space-padded);
+            # the format is fixed, so split it instead of going through strptime
+            month, day, hms, year = date_str.split()
+            hour, minute, second = hms.split(':')
+            date_obj = datetime(
+                int(year), _MONTHS[month], int(day), int(hour), int(minute), int(second)
+            )
             
             # Явно указываем что это UTC (хотя datetime будет naive)
             # В расчетах мы используем utcnow(), так что это корректно
             return date_obj
             
         except Exception as e:
-            logger.error(f"Failed to parse date '{openssl_output}': {str(e)}")
+            logger.error("Failed to parse date '%s': %s", openssl_output, e)
             return None
     
-    async def check_multiple_certificates(self, hosts: list) -> list:
+    async def iter_certificate_checks(self, hosts: list) -> AsyncIterator[Dict]:
         """
-        Check certificates on multiple hosts in parallel.
+        Check certificates on multiple hosts in parallel, yielding results as they complete.
         
         Args:
-            hosts: List of dicts with 'host' and 'node_id' keys
+            hosts: List of dicts with 'host' and 'node_id' keys, and optionally
+                'cert_expiry' and 'verified_at' of the last successful check
             
-        Returns:
-            List of check results
+        Yields:
+            Check results in completion order
         """
-        logger.info(f"Starting certificate checks for {len(hosts)} hosts...")
-        
-        tasks = [
-            self.check_certificate(host_info['host'], host_info['node_id'])
-            for host_info in hosts
-        ]
-        
-        # Run all checks in parallel with return_exceptions to handle failures gracefully
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Starting certificate checks for %d hosts...", len(hosts))
         
-        # Handle any unexpected exceptions
-        processed_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                host_info = hosts[i]
-                logger.error(f"Unhandled exception for {host_info['host']}: {str(result)}")
-                processed_results.append({
+        # Bound concurrent SSH sessions so large fleets don't exhaust sockets/CPU;
+        # unexpected exceptions become error results instead of aborting the run
+        async def bounded_check(host_info: Dict) -> Dict:
+            try:
+                async with self._sem:
+                    return await self.check_certificate(
+                        host_info['host'],
+                        host_info['node_id'],
+                        host_info.get('cert_expiry'),
+                        host_info.get('verified_at')
+                    )
+            except Exception as e:
+                logger.warning("Unhandled exception for %s: %s", host_info['host'], e)
+                return {
                     'node_id': host_info['node_id'],
                     'host': host_info['host'],
                     'status': 'error',
-                    'error_message': f"Unhandled exception: {str(result)}",
+                    'cert_expiry_date': None,
+                    'error_message': f"Unhandled exception: {str(e)}",
                     'days_remaining': -999  # ✅ Добавили для БД
-                })
-            else:
-                processed_results.append(result)
-        
-        # Log summary
-        success_count = sum(1 for r in processed_results if r['status'] == 'success')
-        logger.info(f"Certificate check completed: {success_count}/{len(hosts)} successful")
+                }
         
-        return processed_results
\ No newline at end of file
+        tasks = [asyncio.create_task(bounded_check(host_info)) for host_info in hosts]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Consumer stopped early (or failed): don't leave SSH sessions running
+            for task in tasks:
+                task.cancel()
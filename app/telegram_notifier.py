@@ -1,17 +1,27 @@
 """Telegram notification service."""
+import asyncio
 import logging
-from datetime import datetime, date
-from typing import List
+import time
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
 from telegram import Bot
-from telegram.error import TelegramError
-from sqlalchemy import select
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from sqlalchemy import delete, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import config
-from app.models import TransportNode, CertificateCheck, TelegramNotification
+from app.database import AsyncSessionLocal, insert_ignoring_duplicates
+from app.models import TransportNode, TelegramNotification
 
 logger = logging.getLogger(__name__)
 
+# Telegram allows about one message per second into a single chat
+SEND_INTERVAL = 1.0  # seconds
+# How long shutdown waits for the background sender to drain
+SHUTDOWN_SEND_TIMEOUT = 10  # seconds
+
 
 class TelegramNotifier:
     """Send notifications to Telegram."""
@@ -21,12 +31,68 @@ class TelegramNotifier:
         self.chat_id = config.TELEGRAM_CHAT_ID
         self.bot = None
         
+        # (node_id, notification_type) pairs known to be notified on
+        # _notified_date; lets repeat runs skip the database lookup
+        self._notified_date = None
+        self._notified = set()
+        
+        # (message, notification rows it covers) queued during a scheduler
+        # run, handed to the sender by flush()
+        self._pending: List[Tuple[str, List[Dict]]] = []
+        
+        # Background sender: batches of pending messages sent off the
+        # scheduler path; worker task is started on first use
+        self._send_queue: asyncio.Queue = asyncio.Queue()
+        self._sender_task: Optional[asyncio.Task] = None
+        
+        # Serializes sends and spaces them SEND_INTERVAL apart
+        self._send_lock = asyncio.Lock()
+        self._last_sent = 0.0
+        
         if self.bot_token and self.chat_id:
-            self.bot = Bot(token=self.bot_token)
+            # One pooled client for the notifier's lifetime; short pool_timeout
+            # so a stuck send fails fast instead of stalling the scheduler
+            request = HTTPXRequest(
+                connection_pool_size=16,
+                connect_timeout=5,
+                read_timeout=10,
+                pool_timeout=5
+            )
+            self.bot = Bot(token=self.bot_token, request=request)
             logger.info("Telegram bot initialized")
         else:
             logger.warning("Telegram bot token or chat ID not configured")
     
+    async def close(self):
+        """
+        Wait briefly for queued sends, then close the bot's HTTP client.
+        
+        Alerts still unsent when the wait runs out lose their records, so
+        the next start sends them again.
+        """
+        if self._sender_task is not None:
+            try:
+                await asyncio.wait_for(self._send_queue.join(), timeout=SHUTDOWN_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Dropping %d unsent Telegram batches on shutdown", self._send_queue.qsize())
+            # The worker releases the rows of the batch it was sending
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+            
+            unsent_rows = [row for _, rows in self._pending for row in rows]
+            self._pending = []
+            while not self._send_queue.empty():
+                batch = self._send_queue.get_nowait()
+                unsent_rows.extend(row for _, rows in batch for row in rows)
+                self._send_queue.task_done()
+            if unsent_rows:
+                await self._forget_notifications(unsent_rows)
+        if self.bot:
+            await self.bot.shutdown()
+    
     async def send_message(self, message: str) -> bool:
         """
         Send a message to Telegram.
@@ -41,6 +107,29 @@ class TelegramNotifier:
             logger.warning("Telegram bot not configured, skipping notification")
             return False
         
+        async with self._send_lock:
+            try:
+                try:
+                    await self._send_now(message)
+                except RetryAfter as e:
+                    logger.warning("Telegram rate limit hit, retrying in %ss", e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                    await self._send_now(message)
+                logger.info("Telegram notification sent successfully")
+                return True
+                
+            except TelegramError as e:
+                logger.error(f"Failed to send Telegram message: {str(e)}")
+                return False
+            except Exception as e:
+                logger.error(f"Unexpected error sending Telegram message: {str(e)}", exc_info=True)
+                return False
+    
+    async def _send_now(self, message: str):
+        """Send one message, waiting out the per-chat interval first."""
+        delay = self._last_sent + SEND_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
         try:
             await self.bot.send_message(
                 chat_id=self.chat_id,
@@ -48,15 +137,109 @@ class TelegramNotifier:
                 parse_mode='HTML',
                 disable_web_page_preview=True
             )
-            logger.info("Telegram notification sent successfully")
-            return True
-            
-        except TelegramError as e:
-            logger.error(f"Failed to send Telegram message: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"Unexpected error sending Telegram message: {str(e)}", exc_info=True)
-            return False
+        finally:
+            self._last_sent = time.monotonic()
+    
+    def queue_message(self, message: str, notification_rows: Optional[List[Dict]] = None):
+        """
+        Queue a message to be sent with the next flush().
+        
+        Args:
+            message: Text to send
+            notification_rows: Already committed TelegramNotification rows
+                covered by this message; deleted again if it fails to send
+                so the next run retries them
+        """
+        if self.bot:
+            self._pending.append((message, notification_rows or []))
+    
+    def flush(self):
+        """Hand all queued messages to the background sender."""
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, []
+        self._send_queue.put_nowait(pending)
+        if self._sender_task is None or self._sender_task.done():
+            self._sender_task = asyncio.create_task(self._sender_worker())
+    
+    async def _sender_worker(self):
+        """Send queued batches one at a time, packed into as few messages as possible."""
+        while True:
+            batch = await self._send_queue.get()
+            texts = self._pack_messages([message for message, _ in batch])
+            done = 0
+            # Only messages with a part in a failed text lose their records
+            failed = set()
+            try:
+                for text, indexes in texts:
+                    if not await self.send_message(text):
+                        failed.update(indexes)
+                    done += 1
+                failed_rows = [row for i in sorted(failed) for row in batch[i][1]]
+                if failed_rows:
+                    await self._forget_notifications(failed_rows)
+            except asyncio.CancelledError:
+                # Cancelled on shutdown: texts not sent yet count as failed
+                for _, indexes in texts[done:]:
+                    failed.update(indexes)
+                failed_rows = [row for i in sorted(failed) for row in batch[i][1]]
+                if failed_rows:
+                    try:
+                        await self._forget_notifications(failed_rows)
+                    except Exception as e:
+                        logger.error(f"Could not release unsent Telegram alerts: {str(e)}", exc_info=True)
+                raise
+            except Exception as e:
+                logger.error(f"Error in Telegram sender: {str(e)}", exc_info=True)
+            finally:
+                self._send_queue.task_done()
+    
+    async def _forget_notifications(self, notification_rows: List[Dict]):
+        """Delete records of notifications that failed to send."""
+        keys = [
+            (row['node_id'], row['notification_type'], row['notification_date'])
+            for row in notification_rows
+        ]
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(TelegramNotification).where(
+                    tuple_(
+                        TelegramNotification.node_id,
+                        TelegramNotification.notification_type,
+                        TelegramNotification.notification_date
+                    ).in_(keys)
+                )
+            )
+            await db.commit()
+        self._notified.difference_update((node_id, notification_type) for node_id, notification_type, _ in keys)
+        logger.warning(f"Telegram send failed, {len(keys)} node alerts will be retried")
+    
+    @staticmethod
+    def _pack_messages(messages: List[str]) -> List[Tuple[str, Set[int]]]:
+        """
+        Join messages into texts within Telegram's length limit, splitting on lines.
+        
+        Returns:
+            (text, indexes of the messages with a part in it) pairs
+        """
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        texts = []
+        current = ''
+        indexes = set()
+        for index, message in enumerate(messages):
+            parts = [message] if len(message) <= limit else message.split('\n')
+            for i, part in enumerate(parts):
+                separator = '\n\n' if i == 0 else '\n'
+                if current and len(current) + len(separator) + len(part) > limit:
+                    texts.append((current, indexes))
+                    current = ''
+                    indexes = set()
+                current = f"{current}{separator}{part}" if current else part[:limit]
+                indexes.add(index)
+        if current:
+            texts.append((current, indexes))
+        return texts
     
     async def check_and_notify_expiring_certs(self, db: AsyncSession):
         """
@@ -71,130 +254,133 @@ class TelegramNotifier:
         
         logger.info("Checking for expiring certificates...")
         
-        # Get all active nodes with their latest certificate check
-        query = (
-            select(TransportNode, CertificateCheck)
-            .join(CertificateCheck, TransportNode.id == CertificateCheck.node_id)
+        # Active nodes whose latest known expiry is within the warning window
+        # (whole days counted like the checker), one indexed range scan
+        now = datetime.utcnow()
+        window_days = max(config.CERT_WARNING_DAYS, 7)
+        result = await db.execute(
+            select(
+                TransportNode.id,
+                TransportNode.display_name,
+                TransportNode.ip_address,
+                TransportNode.latest_cert_expiry
+            )
             .where(TransportNode.is_active == True)
-            .where(CertificateCheck.check_status == 'success')
-            .order_by(CertificateCheck.checked_at.desc())
+            .where(TransportNode.latest_cert_expiry < now + timedelta(days=window_days + 1))
         )
         
-        result = await db.execute(query)
-        rows = result.all()
-        
-        # Get latest check for each node
-        node_latest_checks = {}
-        for node, check in rows:
-            if node.id not in node_latest_checks:
-                node_latest_checks[node.id] = (node, check)
-        
         # Group by warning levels
         expiring_soon = []  # < 30 days
         expiring_very_soon = []  # < 7 days
         expired = []  # <= 0 days
         
-        for node, check in node_latest_checks.values():
-            days = check.days_remaining
+        for node in result.all():
+            days = (node.latest_cert_expiry - now).days
             
             if days <= 0:
-                expired.append((node, check))
+                expired.append((node, days))
             elif days <= 7:
-                expiring_very_soon.append((node, check))
+                expiring_very_soon.append((node, days))
             elif days <= config.CERT_WARNING_DAYS:
-                expiring_soon.append((node, check))
+                expiring_soon.append((node, days))
+        
+        if not (expired or expiring_very_soon or expiring_soon):
+            logger.info("No expiring certificates found")
+            return
         
-        # Send notifications
         today_str = date.today().isoformat()
+        if self._notified_date != today_str:
+            self._notified_date = today_str
+            self._notified = set()
         
-        if expired:
-            await self._send_cert_notifications(
-                db, expired, 'cert_expired', today_str,
-                '🔴 <b>КРИТИЧНО: Сертификаты истекли!</b>'
-            )
+        groups = [
+            (expired, 'cert_expired', '🔴 <b>КРИТИЧНО: Сертификаты истекли!</b>'),
+            (expiring_very_soon, 'cert_expiring_7d', '🟠 <b>ВНИМАНИЕ: Сертификаты истекают через 7 дней!</b>'),
+            (expiring_soon, 'cert_expiring_30d', '🟡 <b>Предупреждение: Сертификаты истекают в течение 30 дней</b>'),
+        ]
         
-        if expiring_very_soon:
-            await self._send_cert_notifications(
-                db, expiring_very_soon, 'cert_expiring_7d', today_str,
-                '🟠 <b>ВНИМАНИЕ: Сертификаты истекают через 7 дней!</b>'
+        # Claim today's notifications in one statement, skipping pairs this
+        # process already knows about: the unique constraint drops ones an
+        # earlier or concurrent run recorded, RETURNING yields the rest
+        notification_rows = [
+            {
+                'node_id': node.id,
+                'notification_type': notification_type,
+                'notification_date': today_str
+            }
+            for nodes_days, notification_type, title in groups
+            for node, days in nodes_days
+            if (node.id, notification_type) not in self._notified
+        ]
+        claimed = set()
+        if notification_rows:
+            result = await db.execute(
+                insert_ignoring_duplicates(TelegramNotification)
+                .values(notification_rows)
+                .returning(TelegramNotification.node_id, TelegramNotification.notification_type)
             )
-        
-        if expiring_soon:
-            await self._send_cert_notifications(
-                db, expiring_soon, 'cert_expiring_30d', today_str,
-                '🟡 <b>Предупреждение: Сертификаты истекают в течение 30 дней</b>'
+            claimed = {(row.node_id, row.notification_type) for row in result}
+            # Commit before sending so the session is released while the
+            # messages go out from the background sender
+            await db.commit()
+            self._notified.update(
+                (row['node_id'], row['notification_type']) for row in notification_rows
             )
         
-        if not (expired or expiring_very_soon or expiring_soon):
-            logger.info("No expiring certificates found")
+        # Queue one message per warning level, then send them together
+        for nodes_days, notification_type, title in groups:
+            if nodes_days:
+                self._queue_cert_notifications(
+                    [(node, days) for node, days in nodes_days if (node.id, notification_type) in claimed],
+                    notification_type,
+                    today_str,
+                    title
+                )
+        
+        if claimed:
+            logger.info(f"Queued expiry notifications for {len(claimed)} node alerts")
+        self.flush()
     
-    async def _send_cert_notifications(
-        self,
-        db: AsyncSession,
-        nodes_checks: List,
-        notification_type: str,
-        today_str: str,
-        title: str
-    ):
-        """Send notifications for a group of certificates."""
-        
-        # Filter nodes that haven't been notified today
-        to_notify = []
-        for node, check in nodes_checks:
-            # Check if already notified today
-            query = select(TelegramNotification).where(
-                TelegramNotification.node_id == node.id,
-                TelegramNotification.notification_type == notification_type,
-                TelegramNotification.notification_date == today_str
-            )
-            result = await db.execute(query)
-            existing = result.scalar_one_or_none()
-            
-            if not existing:
-                to_notify.append((node, check))
+    def _queue_cert_notifications(self, to_notify: List, notification_type: str, today_str: str, title: str):
+        """
+        Queue the notification for a group of certificates.
         
+        Args:
+            to_notify: (node, days) pairs claimed for notification today
+            notification_type: Notification type of the group
+            today_str: Notification date the claims were recorded under
+            title: Message header
+        """
         if not to_notify:
             logger.info(f"No new {notification_type} notifications to send")
             return
         
         # Build message
-        message_lines = [title, '']
-        
-        for node, check in to_notify:
-            days = check.days_remaining
-            expiry_date = check.cert_expiry_date.strftime('%Y-%m-%d')
-            
-            if days <= 0:
-                days_text = f"<b>ИСТЁК {abs(days)} дней назад</b>"
-            else:
-                days_text = f"{days} дней"
-            
-            message_lines.append(
-                f"• <b>{node.display_name}</b> ({node.ip_address})\n"
-                f"  Истекает: {expiry_date} ({days_text})"
-            )
-        
-        message = '\n'.join(message_lines)
-        
-        # Send notification
-        sent = await self.send_message(message)
-        
-        # Record notifications in database
-        if sent:
-            for node, check in to_notify:
-                notification = TelegramNotification(
-                    node_id=node.id,
-                    notification_type=notification_type,
-                    notification_date=today_str
-                )
-                db.add(notification)
-            
-            await db.commit()
-            logger.info(f"Sent {notification_type} notification for {len(to_notify)} nodes")
+        body = '\n'.join(
+            f"• <b>{node.display_name}</b> ({node.ip_address})\n"
+            f"  Истекает: {node.latest_cert_expiry.date().isoformat()} ({self._days_text(days)})"
+            for node, days in to_notify
+        )
+        notification_rows = [
+            {
+                'node_id': node.id,
+                'notification_type': notification_type,
+                'notification_date': today_str
+            }
+            for node, _ in to_notify
+        ]
+        self.queue_message(f"{title}\n\n{body}", notification_rows)
     
-    async def notify_new_nodes(self, new_nodes: List[TransportNode]):
+    @staticmethod
+    def _days_text(days: int) -> str:
+        """Human-readable days until (or since) expiry."""
+        if days <= 0:
+            return f"<b>ИСТЁК {abs(days)} дней назад</b>"
+        return f"{days} дней"
+    
+    def notify_new_nodes(self, new_nodes: List[TransportNode]):
         """
-        Send notification about newly discovered nodes.
+        Queue notification about newly discovered nodes.
         
         Args:
             new_nodes: List of newly added TransportNode objects
@@ -202,21 +388,17 @@ class TelegramNotifier:
         if not new_nodes or not self.bot:
             return
         
-        message_lines = ['🆕 <b>Обнаружены новые Edge Transport Nodes:</b>', '']
-        
-        for node in new_nodes:
-            message_lines.append(
-                f"• <b>{node.display_name}</b>\n"
-                f"  IP: {node.ip_address}\n"
-                f"  ID: {node.id}"
-            )
-        
-        message = '\n'.join(message_lines)
-        await self.send_message(message)
+        body = '\n'.join(
+            f"• <b>{node.display_name}</b>\n"
+            f"  IP: {node.ip_address}\n"
+            f"  ID: {node.id}"
+            for node in new_nodes
+        )
+        self.queue_message(f"🆕 <b>Обнаружены новые Edge Transport Nodes:</b>\n\n{body}")
     
-    async def notify_removed_nodes(self, removed_nodes: List[TransportNode]):
+    def notify_removed_nodes(self, removed_nodes: List[TransportNode]):
         """
-        Send notification about removed nodes.
+        Queue notification about removed nodes.
         
         Args:
             removed_nodes: List of removed TransportNode objects
@@ -224,13 +406,9 @@ class TelegramNotifier:
         if not removed_nodes or not self.bot:
             return
         
-        message_lines = ['❌ <b>Edge Transport Nodes удалены из NSX:</b>', '']
-        
-        for node in removed_nodes:
-            message_lines.append(
-                f"• <b>{node.display_name}</b>\n"
-                f"  IP: {node.ip_address}"
-            )
-        
-        message = '\n'.join(message_lines)
-        await self.send_message(message)
+        body = '\n'.join(
+            f"• <b>{node.display_name}</b>\n"
+            f"  IP: {node.ip_address}"
+            for node in removed_nodes
+        )
+        self.queue_message(f"❌ <b>Edge Transport Nodes удалены из NSX:</b>\n\n{body}")